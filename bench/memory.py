@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Memory benchmark for the bookmark records a sync keeps.
+#
+#   python3 bench/memory.py [--diigorg PATH] [--annotations SHARE] [count]
+#
+# Measures with tracemalloc how much memory each of `count` (default 100k) bookmarks takes:
+#   DiigoBookmark            built from synthetic API tranches, as a fetch makes them
+#   OrgBookmark, collected   one per org file, as a walk of the tree makes them
+#   OrgBookmark, parsed      the same, after reading each file, including its manifest entry
+# The org files are written straight from the DiigoBookmarks, without a sync.
+# --diigorg measures another copy of diigorg.py, e.g. one from an older commit:
+#   git show HEAD~1:diigorg.py > /tmp/diigorg_before.py && python3 bench/memory.py --diigorg /tmp/diigorg_before.py
+
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import mock_diigo
+from sync import make_tree
+
+def load_diigorg(path):
+    spec = importlib.util.spec_from_file_location('diigorg', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['diigorg'] = module
+    spec.loader.exec_module(module)
+    return module
+
+def footprint(label, count, build, base=0):
+    "run build(), and print how many bytes it left allocated, plus `base`, for each of `count` bookmarks. Returns the result and the bytes"
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    used += base
+    print(f'{label.ljust(26)} {used / count:10.0f} {used / 2**20:10.1f} {elapsed:9.2f}')
+    return result, used
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory each bookmark record takes.')
+    parser.add_argument('count', type=int, nargs='?', default=100000)
+    parser.add_argument('--diigorg', default=os.path.join(REPO_DIR, 'diigorg.py'), help='the diigorg.py to measure')
+    parser.add_argument('--annotations', type=float, default=0.2, help='share of bookmarks with highlights')
+    args = parser.parse_args()
+
+    diigorg = load_diigorg(args.diigorg)
+    raw = mock_diigo.synthetic_bookmarks(args.count, args.annotations)
+    # what the fetch gets from diigo.com, one tranche of 100 at a time
+    tranches = [json.dumps(raw[start:start + 100]) for start in range(0, len(raw), 100)]
+    del raw
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_tree(directory, 'http://127.0.0.1:9/api/v2/bookmarks')
+        syncer = diigorg.Syncer(directory, interactive=False, yes=True)
+        # imports and caches that the first bookmark sets up shouldn't count
+        diigorg.DiigoBookmark(syncer, json.loads(tranches[0])[0])
+
+        print(f'{args.diigorg}\n{args.count} bookmarks')
+        print(f'{"record".ljust(26)} {"bytes each".rjust(10)} {"MB".rjust(10)} {"seconds".rjust(9)}')
+        fetched, used = footprint('DiigoBookmark', args.count,
+                            lambda: [diigorg.DiigoBookmark(syncer, b) for tranche in tranches for b in json.loads(tranche)])
+
+        for rbm in fetched:
+            os.makedirs(os.path.dirname(rbm.file), exist_ok=True)
+            with open(rbm.file, 'w', encoding='utf-8') as f:
+                f.write(rbm._DiigoBookmark__create_bookmark_file_synced_section())
+        files = [rbm.file for rbm in fetched]
+        del fetched
+
+        collected, used = footprint('OrgBookmark, collected', args.count, lambda: [diigorg.OrgBookmark(syncer, file) for file in files])
+        footprint('OrgBookmark, parsed', args.count, lambda: [lbm.parse_and_fill_out() for lbm in collected], base=used)
+
+if __name__ == '__main__':
+    sys.exit(main())
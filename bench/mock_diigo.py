@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# A local stand-in for diigo.com's /api/v2/bookmarks, for benchmarking diigorg offline.
+#
+#   python3 bench/mock_diigo.py [--port 8321] [--count 10000] [--latency 0.05] [--annotations 0.2] [--desc-length 200]
+#
+# Serves `count` synthetic bookmarks over GET (start, count, sort and tags like the real API),
+# adds or replaces bookmarks by url on POST and deletes them by url on DELETE, sleeping
+# `latency` seconds before answering each request. Credentials and keys are accepted unchecked.
+# Point diigorg at it with `api_url = http://127.0.0.1:8321/api/v2/bookmarks` in the [network]
+# section of diigorg.cfg. bench/sync.py starts one of these in-process.
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PATH = '/api/v2/bookmarks'
+TAGS = ['python', 'org', 'emacs', 'web_dev', 'read@home', 'diigo', 'x11', 'linux', 'music', 'recipes',
+        'history', 'maths', 'typography', 'c++', 'rust', 'javascript', 'photography', 'travel', 'books', 'later']
+WORDS = ['the', 'a', 'guide', 'to', 'notes', 'on', 'how', 'why', 'fast', 'slow', 'sync', 'bookmarks', 'org', 'mode',
+         'crème', 'brûlée', 'über', 'naïve', 'café', 'part', 'review', 'introduction', 'deep', 'dive', 'into', '2.0']
+
+def diigo_time(moment):
+    return moment.strftime('%Y/%m/%d %H:%M:%S %z')
+
+def synthetic_bookmarks(count, annotations=0.2, desc_length=200, seed=0):
+    "`count` bookmarks as diigo's API returns them. `annotations` is the share of bookmarks with highlights."
+    rng = random.Random(seed)
+    start = datetime(2008, 1, 1, tzinfo=timezone.utc)
+    span = int((datetime(2024, 1, 1, tzinfo=timezone.utc) - start).total_seconds())
+    bookmarks = []
+    for index in range(count):
+        created = start + timedelta(seconds=rng.randrange(span))
+        updated = created + timedelta(seconds=rng.randrange(90 * 24 * 3600)) if rng.random() < 0.3 else created
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 9))).capitalize() + f' {index}'
+        desc = ' '.join(rng.choice(WORDS) for _ in range(desc_length // 6))[:desc_length] if rng.random() < 0.5 else ''
+        highlights = []
+        if rng.random() < annotations:
+            for n in range(rng.randint(1, 4)):
+                highlights.append({'content' : ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))),
+                                   'comments' : [{'content' : f'comment {n}', 'user' : 'bench', 'created_at' : diigo_time(updated)}] if rng.random() < 0.3 else []})
+        bookmarks.append({
+            'title' : title,
+            'url' : f'https://example.com/{index}/{rng.choice(WORDS)}?page={rng.randint(1, 9)}',
+            'user' : 'bench',
+            'desc' : desc,
+            'tags' : ','.join(rng.sample(TAGS, rng.randint(0, 5))) or 'no_tag',
+            'shared' : 'yes' if rng.random() < 0.7 else 'no',
+            'readlater' : 'yes' if rng.random() < 0.1 else 'no',
+            'created_at' : diigo_time(created),
+            'updated_at' : diigo_time(updated),
+            'comments' : [],
+            'annotations' : highlights,
+        })
+    return bookmarks
+
+class MockDiigo:
+    "the bookmarks behind the server, and counts of the requests it answered"
+    SORT_KEYS = {'0' : 'created_at', '1' : 'updated_at', '3' : 'title'}
+
+    def __init__(self, bookmarks, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.bookmarks = {b['url'] : b for b in bookmarks}
+        self.sorted = {}
+        self.requests = {'GET' : 0, 'POST' : 0, 'DELETE' : 0}
+
+    def __sorted(self, sort):
+        key = self.SORT_KEYS.get(sort, 'updated_at')
+        if key not in self.sorted:
+            if key == 'title':
+                self.sorted[key] = sorted(self.bookmarks.values(), key=lambda b: b['title'])
+            else:
+                self.sorted[key] = sorted(self.bookmarks.values(), key=lambda b: datetime.strptime(b[key], '%Y/%m/%d %H:%M:%S %z'), reverse=True)
+        return self.sorted[key]
+
+    def get(self, params):
+        start = int(params.get('start', 0))
+        count = min(int(params.get('count', 10)), 100)
+        with self.lock:
+            bookmarks = self.__sorted(params.get('sort', '1'))
+        if params.get('tags'):
+            tags = params['tags'].split(',')
+            bookmarks = [b for b in bookmarks if all(tag in b['tags'].split(',') for tag in tags)]
+        return bookmarks[start:start + count]
+
+    def post(self, bookmark):
+        now = diigo_time(datetime.now(timezone.utc))
+        with self.lock:
+            old = self.bookmarks.get(bookmark['url'])
+            self.bookmarks[bookmark['url']] = {
+                'title' : bookmark.get('title', ''),
+                'url' : bookmark['url'],
+                'user' : 'bench',
+                'desc' : bookmark.get('desc', ''),
+                'tags' : bookmark.get('tags', '') or 'no_tag',
+                'shared' : bookmark.get('shared', 'no' if bookmark.get('private') == 'yes' else 'yes'),
+                'readlater' : bookmark.get('readLater', bookmark.get('readlater', 'no')),
+                'created_at' : old['created_at'] if old else now,
+                'updated_at' : now,
+                'comments' : old['comments'] if old else [],
+                'annotations' : old['annotations'] if old else [],
+            }
+            self.sorted.clear()
+        return {'code' : 1, 'message' : 'Saved 1 bookmark(s)'}
+
+    def delete(self, bookmark):
+        with self.lock:
+            found = self.bookmarks.pop(bookmark.get('url'), None)
+            self.sorted.clear()
+        return {'code' : 1, 'message' : 'Deleted 1 bookmark(s)' if found else 'Deleted 0 bookmark(s)'}
+
+class Handler(BaseHTTPRequestHandler):
+    # keep connections alive, as requests.Session expects of diigo.com
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def __answer(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        mock = self.server.mock
+
+        with mock.lock:
+            mock.requests[self.command] += 1
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        if url.path != API_PATH:
+            status, result = 404, {'message' : 'not found'}
+        else:
+            params = {k : v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                if self.command == 'GET':
+                    status, result = 200, mock.get(params)
+                else:
+                    bookmark = {**params, **json.loads(body or b'{}')}
+                    status, result = 200, (mock.post if self.command == 'POST' else mock.delete)(bookmark)
+            except (ValueError, KeyError) as e:
+                status, result = 400, {'message' : f'bad request: {e}'}
+
+        data = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = __answer
+
+def start_server(mock, port=0):
+    "serve `mock` on 127.0.0.1 from a background thread. Returns the server and its api url."
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}{API_PATH}'
+
+def main():
+    parser = argparse.ArgumentParser(description='A local stand-in for the diigo.com bookmarks API.')
+    parser.add_argument('--port', type=int, default=8321)
+    parser.add_argument('--count', type=int, default=10000, help='number of synthetic bookmarks to serve')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering each request')
+    parser.add_argument('--annotations', type=float, default=0.2, help='share of bookmarks with highlights')
+    parser.add_argument('--desc-length', type=int, default=200, help='length of the descriptions that are not empty')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockDiigo(synthetic_bookmarks(args.count, args.annotations, args.desc_length, args.seed), args.latency)
+    server, api_url = start_server(mock, args.port)
+    print(f'serving {args.count} bookmarks at {api_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f'answered {mock.requests}')
+
+if __name__ == '__main__':
+    sys.exit(main())
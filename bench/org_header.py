@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark for reading the synced first heading of org bookmark files.
+#
+#   python3 bench/org_header.py [count] [notes_lines]
+#
+# Writes `count` (default 2000) synthetic bookmark files to a temporary directory, each with
+# a notes section of about `notes_lines` (default 500) lines, then times diigorg.read_org_header
+# against a full orgparse load of every file, and checks that both read the same fields.
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diigorg
+
+TODO_KEYWORD = 'TODO'
+
+def synthetic_file(index, notes_lines):
+    tags = random.sample(['python', 'org', 'emacs', 'web_dev', 'read@home', 'diigo', 'x11'], random.randint(0, 4))
+    heading_tags = f' :{":".join(tags)}:' if tags and index % 3 else ''
+    lines = []
+    if index % 3 == 0 and tags:
+        lines.append(f'#+FILETAGS: :{":".join(tags)}:')
+    if index % 2:
+        lines.append(f'#+TITLE: Bookmark {index}')
+    todo = f'{TODO_KEYWORD} ' if index % 4 == 0 else ''
+    lines.append(f'* {todo}[[https://example.com/{index}?q=a%20b][Bookmark {index}: [draft] notes]]{heading_tags}')
+    lines += [':PROPERTIES:', ':CREATED: [2021-01-01 Fri 10:00:00]', f':ID: {index:08d}-0000-0000-0000-000000000000',
+              f':ID2: 210101{index:04d}', f':PRIVATE: {"yes" if index % 5 else "no"}', ':END:']
+    if index % 2:
+        lines.append(f'A description with a [[https://example.com/{index}][link]] in it.')
+    if index % 7 == 0:
+        lines += ['#+BEGIN_SRC html', f'<p>highlight {index}</p>', '#+END_SRC']
+    lines.append('* Notes')
+    for n in range(notes_lines):
+        lines.append(f'** Note {n} :tag:' if n % 50 == 0 else f'Some notes about [[https://example.org/{n}][page {n}]], line {n}.')
+    return '\n'.join(lines) + '\n'
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    notes_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for index in range(count):
+            file = os.path.join(directory, f'{index}.org')
+            with open(file, 'w', encoding='utf-8') as f:
+                f.write(synthetic_file(index, notes_lines))
+            files.append(file)
+
+        started = time.perf_counter()
+        expected = [diigorg.read_org_header_with_orgparse(file, TODO_KEYWORD) for file in files]
+        orgparse_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = []
+        for file in files:
+            with open(file, 'r', encoding='utf-8', newline='') as f:
+                results.append(diigorg.read_org_header(f, TODO_KEYWORD))
+        header_time = time.perf_counter() - started
+
+    print(f'{count} files, {notes_lines} lines of notes each')
+    print(f'{"orgparse".ljust(16)} {orgparse_time:8.3f}s {orgparse_time / count * 1e3:8.3f}ms/file')
+    print(f'{"read_org_header".ljust(16)} {header_time:8.3f}s {header_time / count * 1e3:8.3f}ms/file')
+    print(f'speedup: {orgparse_time / header_time:.1f}x')
+
+    mismatches = [file for file, a, b in zip(files, expected, results) if a != b]
+    print(f'mismatches: {len(mismatches)}')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Startup benchmark for diigorg.
+#
+#   python3 bench/startup.py
+#
+# Measures the cumulative import time of diigorg with `python -X importtime`, next to the
+# modules it used to import at startup and now only imports when they are needed.
+# If django is installed, also checks that diigorg.slugify still gives byte-for-byte the
+# same output as django's slugify, which diigorg used to import for it.
+
+import os
+import re
+import sys
+import random
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+
+LAZY_MODULES = ['django.template.defaultfilters', 'orgparse', 'dateutil.parser', 'shortuuid']
+
+def import_time(module):
+    "cumulative microseconds spent importing `module` in a fresh interpreter, per -X importtime"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    for line in reversed(result.stderr.splitlines()):
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match and not match.group(2) and match.group(3) == module:
+            return int(match.group(1))
+    return None
+
+def report_import_times():
+    print(f'{"module".ljust(36)} {"median ms".rjust(10)}')
+    for module in ['diigorg'] + LAZY_MODULES:
+        times = [import_time(module) for _ in range(RUNS)]
+        if None in times:
+            print(f'{module.ljust(36)} {"not installed".rjust(10)}')
+        else:
+            print(f'{module.ljust(36)} {statistics.median(times) / 1000:10.1f}')
+
+def title_corpus(count=50000):
+    random.seed(0)
+    alphabet = [chr(c) for c in list(range(32, 0x250)) + list(range(0x2000, 0x2070)) + [0x3000, 0xFB01, 0x1F389]]
+    corpus = ['Diigo API Help', '  --Leading and trailing--  ', 'Crème brûlée & C++ — “quotes”', '日本語のタイトル', 'İstanbul ß ﬁ ǅ', '']
+    corpus += [''.join(random.choice(alphabet) for _ in range(random.randint(0, 80))) for _ in range(count)]
+    return corpus
+
+def check_slugify():
+    try:
+        from django.template.defaultfilters import slugify as django_slugify
+    except ImportError:
+        print('\ndjango is not installed. Skipping the slugify comparison; test/test_slugify.py checks a fixed set of titles without it.')
+        return True
+
+    sys.path.insert(0, REPO_DIR)
+    import diigorg
+
+    corpus = title_corpus()
+    mismatches = [title for title in corpus if diigorg.slugify(title) != django_slugify(title)]
+    print(f'\nslugify: {len(corpus) - len(mismatches)}/{len(corpus)} titles match django')
+    for title in mismatches[:10]:
+        print(f'  {title!r}: {diigorg.slugify(title)!r} != {django_slugify(title)!r}')
+    return not mismatches
+
+if __name__ == '__main__':
+    report_import_times()
+    sys.exit(0 if check_slugify() else 1)
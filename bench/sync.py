@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# End-to-end sync benchmark against bench/mock_diigo.py, so that it runs offline.
+#
+#   python3 bench/sync.py [--latency SECONDS] [--annotations SHARE] [count ...]
+#
+# For each count of synthetic bookmarks (default 1000, 10000 and 100000), starts a mock
+# diigo.com in-process, syncs them into an empty org tree, and then times each phase of
+# a sync on its own:
+#   fetch        pulling every bookmark from the mock, as a full sync does
+#   collect      walking the org tree
+#   parse        reading every org file, with an empty manifest, in processes as a full sync does,
+#                and with a full manifest
+#   plan         full and incremental syncs with nothing to do
+#   regenerate   rendering every org file again from the bookmarks kept in .diigorg, with no requests
+#   execute      downloading everything, uploading 1% of the files after editing them,
+#                and deleting 1% of the bookmarks from the mock after removing their files
+# Requests the mock answered during each phase are counted alongside.
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import configparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diigorg
+import mock_diigo
+
+def make_tree(directory, api_url):
+    "an empty org tree whose diigorg.cfg points at the mock"
+    cfg_file = os.path.join(directory, 'diigorg.cfg')
+    diigorg.create_default_config(cfg_file)
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read(cfg_file)
+    cfg['diigo_credentials'] = {'username' : 'bench', 'passwd' : 'bench', 'api_key' : 'bench'}
+    cfg['network']['api_url'] = api_url
+    cfg['network']['requests_per_second'] = '0'
+    cfg['network']['retry_backoff'] = '0.01'
+    with open(cfg_file, 'w') as f:
+        cfg.write(f)
+
+    os.makedirs(os.path.join(directory, '.diigorg'), exist_ok=True)
+    with open(os.path.join(directory, '.diigorg', '.diigorg.sync'), 'w') as f:
+        f.write('0')
+
+class Phases:
+    "times the phases of one benchmark run and prints a row for each"
+    def __init__(self, count, mock):
+        self.count = count
+        self.mock = mock
+        print(f'\n{count} bookmarks')
+        print(f'{"phase".ljust(36)} {"seconds".rjust(9)} {"us/bookmark".rjust(12)}  requests')
+
+    def __call__(self, label, function):
+        requests_before = dict(self.mock.requests)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - started
+        requests = ' '.join(f'{method} {n - requests_before[method]}' for method, n in self.mock.requests.items() if n != requests_before[method])
+        print(f'{label.ljust(36)} {elapsed:9.3f} {elapsed / self.count * 1e6:12.1f}  {requests}')
+        return result
+
+def syncer(directory, **options):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return diigorg.Syncer(directory, interactive=False, yes=True, **options)
+
+def wait_past_last_sync(syncer):
+    "so that files touched from now on are newer than the last sync"
+    while time.time() <= syncer.last_sync_time:
+        time.sleep(0.05)
+
+def run(count, latency, annotations):
+    mock = mock_diigo.MockDiigo(mock_diigo.synthetic_bookmarks(count, annotations), latency)
+    server, api_url = mock_diigo.start_server(mock)
+    timed = Phases(count, mock)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            make_tree(directory, api_url)
+
+            first = syncer(directory)
+            timed('plan: first sync, empty tree', first.plan)
+            timed(f'execute: download {len(first.bookmarks_to_download)}', first.execute)
+
+            fetching = syncer(directory, full_sync=True)
+            timed('fetch: full', lambda: sum(1 for rbm in fetching.fetch_diigo_bookmarks()))
+            fetching.fetch_checkpoint.clear()
+
+            os.remove(os.path.join(directory, '.diigorg', 'manifest.sqlite'))
+            collecting = syncer(directory)
+            timed('collect', collecting.collect_local_bookmarks)
+            timed('parse: empty manifest', lambda: [lbm.parse_and_fill_out() for lbm in collecting.local_bookmark_list])
+
+            # the manifest above wasn't saved, so this one starts out empty too
+            collecting = syncer(directory)
+            collecting.collect_local_bookmarks()
+            # at least two, so that there is a pool to time even on one core
+            workers = max(2, collecting.cfg.getint('options', 'parse_workers', fallback=0) or os.cpu_count())
+            collecting.cfg['options']['parse_workers'] = str(workers)
+            timed(f'parse: empty manifest, {workers} processes', collecting.parse_local_bookmarks)
+            for lbm in collecting.local_bookmark_list:
+                lbm.parse_and_fill_out()
+            collecting.manifest.save()
+
+            collecting = syncer(directory)
+            collecting.collect_local_bookmarks()
+            timed('parse: full manifest', lambda: [lbm.parse_and_fill_out() for lbm in collecting.local_bookmark_list])
+
+            timed('plan: full sync, nothing to do', syncer(directory, full_sync=True).plan)
+            timed('plan: incremental, nothing to do', syncer(directory).plan)
+
+            regenerating = syncer(directory, regenerate=True)
+            timed('plan: regenerate', regenerating.plan)
+            timed(f'execute: regenerate {len(regenerating.bookmarks_to_regenerate)}', regenerating.execute)
+
+            files = sorted(lbm.file for lbm in collecting.local_bookmark_list)
+            random.seed(0)
+            sample = random.sample(files, max(1, count // 100))
+
+            wait_past_last_sync(first)
+            for file in sample[:len(sample) // 2 or 1]:
+                with open(file, 'a', encoding='utf-8') as f:
+                    f.write('An edit.\n')
+            uploading = syncer(directory)
+            timed('plan: incremental, 1% edited', uploading.plan)
+            timed(f'execute: upload {len(uploading.bookmarks_to_upload)}', uploading.execute)
+
+            for file in sample[len(sample) // 2:]:
+                os.remove(file)
+            deleting = syncer(directory)
+            timed('plan: incremental, 1% removed', deleting.plan)
+            timed(f'execute: delete {len(deleting.bookmarks_to_delete_remotely)} on server', deleting.execute)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the phases of a sync against a local mock of diigo.com.')
+    parser.add_argument('counts', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the mock waits before answering each request')
+    parser.add_argument('--annotations', type=float, default=0.2, help='share of bookmarks with highlights')
+    args = parser.parse_args()
+
+    for count in args.counts:
+        run(count, args.latency, args.annotations)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Microbenchmark for parsing diigo's created_at/updated_at timestamps.
+#
+#   python3 bench/timestamps.py [count]
+#
+# Times diigorg.parse_diigo_timestamp against dateutil's parser, which DiigoBookmark
+# used to call twice per bookmark, over `count` (default 100k) generated timestamps,
+# and checks that both give the same results.
+
+import os
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+
+from dateutil import parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diigorg
+
+def diigo_timestamps(count):
+    random.seed(0)
+    start = datetime(2005, 1, 1, tzinfo=timezone.utc)
+    offsets = [timedelta(hours=h) for h in range(-11, 13)] + [timedelta(hours=5, minutes=30), timedelta(hours=-3, minutes=-30)]
+    stamps = []
+    for _ in range(count):
+        offset = random.choice(offsets)
+        moment = (start + timedelta(seconds=random.randrange(20 * 365 * 24 * 3600))).astimezone(timezone(offset))
+        stamps.append(moment.strftime('%Y/%m/%d %H:%M:%S %z'))
+    return stamps
+
+def timed(label, parse, stamps):
+    started = time.perf_counter()
+    results = [parse(stamp) for stamp in stamps]
+    elapsed = time.perf_counter() - started
+    print(f'{label.ljust(24)} {elapsed:8.3f}s {elapsed / len(stamps) * 1e6:8.2f}us/timestamp')
+    return results, elapsed
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    stamps = diigo_timestamps(count)
+
+    expected, dateutil_time = timed('dateutil.parser.parse', lambda stamp: int(parser.parse(stamp).timestamp()), stamps)
+    results, fast_time = timed('parse_diigo_timestamp', diigorg.parse_diigo_timestamp, stamps)
+
+    print(f'speedup: {dateutil_time / fast_time:.1f}x')
+    mismatches = sum(1 for a, b in zip(expected, results) if a != b)
+    print(f'mismatches: {mismatches}')
+    sys.exit(1 if mismatches else 0)
@@ -6,19 +6,28 @@ import os
 import sys
 import logging
 import requests
+import requests.adapters
 from requests.auth import HTTPBasicAuth
-from dateutil import parser
 import argparse
 import itertools
-import orgparse
-from datetime import datetime
-from django.template.defaultfilters import slugify
+from datetime import datetime, timedelta, timezone
 import time
-import shortuuid
 import uuid
 import re
+import unicodedata
 import glob
+import shutil
 import configparser
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import json
+import hashlib
+import sqlite3
+import threading
+import select
+import struct
+import contextlib
+import functools
 
 
 def dir_path(path):
@@ -36,79 +45,172 @@ argParser.add_argument('-y','--yes', nargs='?', const=True, help='If specified,
 argParser.add_argument('--test', nargs='?', const=True, help='for debugging only. do not use.')
 argParser.add_argument('--fix-tags-on-server', nargs='?', const=True, help='If specified, diigorg will make all diigo server tags org-compliant')
 argParser.add_argument('--force-update-all-local', nargs='?', const=True, help='If specified, all bookmarks will be updated. Use after making changes to diigorg.cfg')
-args = argParser.parse_args()
-
-####### CONFIG FILE
-cfg = configparser.ConfigParser()
-CFG_FILE = os.path.join(args.dir, 'diigorg.cfg')
-
-if os.path.exists(CFG_FILE):
-    cfg.read(CFG_FILE)
-
-    if not cfg.getboolean("file_properties","tags",fallback=False) and not cfg.getboolean("heading_properties", "tags", fallback=False):
-        print( "diigorg.cfg error: Both file_properties:tags and heading_properties:tags are set off. One of them needs to be on." )
-        exit()
-else:
-    cfg.add_section('diigo_credentials')
-    cfg['diigo_credentials'] = {
-        'username' : '',
-        'passwd' : '',
-        'api_key' : 'Get your diigo application key here: https://www.diigo.com/api_keys/new/'
-    }
-    cfg.add_section('options')
-    cfg['options'] = {
-        'subdirs' : '%%Y',
-        'todo_keyword' : 'TODO',
-        'notes_section' : 'yes'
-    }
-    cfg.add_section('file_properties')
-    cfg['file_properties'] = {
-        'title' : 'yes',
-        'org_id' : 'no',
-        'roam_refs' : 'no',
-        'diigo_search_link' : 'no',
-        'tags' : 'no'
-        }
-    cfg.add_section('heading_properties')
-    cfg['heading_properties'] = {
-        'org_id' : 'yes',
-        'roam_refs' : 'no',
-        'diigo_search_link' : 'yes',
-        'tags' : 'yes'
-        }
-
-    with open(CFG_FILE, 'w') as cfgfile:
-        cfg.write(cfgfile)
-    print( 'diigorg.cfg has been created. Edit it and rerun diigorg.' )
-    exit()
-
-if not args.dir.endswith('/'):
-    args.dir = args.dir + '/'
-
-stuff_dir = os.path.join(args.dir, '.diigorg')
-if not os.path.exists(stuff_dir):
-    os.mkdir(stuff_dir)
-
-if args.reset:
-    args.full_sync = True
-    args.safe = True
-elif args.force_update_all_local:
-    args.full_sync = True
-    args.safe = True
-
-if args.fix_tags_on_server:
-    args.full_sync = True
-
-logging.basicConfig(filename=os.path.join(stuff_dir,'diigorg.log'), encoding='utf-8', level=logging.INFO, filemode='w')
+argParser.add_argument('--regenerate', nargs='?', const=True, help='If specified, diigorg will rewrite every org file from the copies of the bookmarks it keeps in .diigorg, without contacting diigo.com. Files edited since the last sync are left alone')
+argParser.add_argument('--since', metavar='YYYY-MM-DD', help='If specified, diigorg will only sync the bookmarks created on or after this day')
+argParser.add_argument('--until', metavar='YYYY-MM-DD', help='If specified, diigorg will only sync the bookmarks created on or before this day')
+argParser.add_argument('--folder', help='If specified, diigorg will only sync the org files in this folder, e.g. a year folder made by subdirs, and the bookmarks that belong in it')
+argParser.add_argument('--tag', help='If specified, diigorg will only sync the bookmarks with this tag. A --full-sync with --tag doesn\'t delete local files')
+argParser.add_argument('--sweep', type=int, metavar='PAGES', help='How many pages of older bookmarks each incremental sync also checks the way a full sync would, carrying on from where the last one stopped. Defaults to sweep_pages under [network] in diigorg.cfg, or 0 for none')
+argParser.add_argument('--daemon', nargs='?', const=300, type=int, metavar='SECONDS', help='If specified, diigorg will keep running, and sync every SECONDS (default 300) and whenever an org file changes. Conflicts are left for a normal run to resolve')
+argParser.add_argument('--log-level', type=str.upper, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='How much to write to .diigorg/diigorg.log. Defaults to log_level under [options] in diigorg.cfg, or INFO')
+argParser.add_argument('--metrics', metavar='FILE', help='Where to write the timings and counts of each sync. JSON, or prometheus\' textfile format if FILE ends in .prom. Defaults to .diigorg/metrics.json')
+argParser.add_argument('--profile', nargs='?', const=True, metavar='FILE', help='If specified, diigorg will run under cProfile, print the slowest calls and save the stats to FILE (default .diigorg/diigorg.prof). Only the main thread is profiled')
 
 ORG_TIMESTAMP_FORMAT = '[%Y-%m-%d %a %H:%M:%S]'
 FILENAME_DELIMITER = ' '
-
-num_dl = 0
-num_ul = 0
-num_del = 0
+# the day a bookmark was created, and 4 characters of shortuuid's alphabet
+SHORT_ID_RE = re.compile(r'\d{6}[2-9A-HJ-NP-Za-km-z]{4}')
 
 spinner = itertools.cycle(['-', '\\', '|', '/'])
+
+class SyncError(Exception):
+    "a problem that stops a sync, like a bad diigorg.cfg or an error from diigo.com"
+
+# timings and counts of what one sync did, to see where its time goes. Timings are kept as count, total and longest,
+# and names with a ':' in them, like 'http:GET', are one kind of thing among several.
+class SyncMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.timings = {}
+            self.counters = collections.Counter()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def add(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def report(self):
+        with self.lock:
+            return {
+                'started' : self.started,
+                'seconds' : time.time() - self.started,
+                'timings' : {name : {'count' : count, 'seconds' : total, 'max_seconds' : longest}
+                             for name, (count, total, longest) in sorted(self.timings.items())},
+                'counters' : dict(sorted(self.counters.items())),
+            }
+
+    @staticmethod
+    def prometheus(report):
+        "`report` in prometheus' text format, for node_exporter's textfile collector"
+        def metric(name, suffix):
+            family, _, kind = name.partition(':')
+            family = 'diigorg_' + re.sub('[^a-zA-Z0-9_]', '_', family) + suffix
+            return family, f'{{kind="{kind}"}}' if kind else ''
+
+        lines = [f'diigorg_last_sync_timestamp_seconds {report["started"]}', f'diigorg_sync_seconds {report["seconds"]}']
+        for name, timing in report['timings'].items():
+            family, labels = metric(name, '_seconds')
+            lines += [f'{family}_count{labels} {timing["count"]}', f'{family}_sum{labels} {timing["seconds"]}',
+                      f'{family}_max{labels} {timing["max_seconds"]}']
+        for name, value in report['counters'].items():
+            family, labels = metric(name, '_total')
+            lines.append(f'{family}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, **extra):
+        "write the report to `path`, with `extra` counters, replacing it in one go so that a collector never sees half of it"
+        report = self.report()
+        report['counters'].update(extra)
+        text = self.prometheus(report) if path.endswith('.prom') else json.dumps(report, indent=1)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+# all calls to the diigo api go through one of these, so that they share a pooled
+# keep-alive session, and so that busy or flaky responses are retried instead of ending the run.
+class DiigoClient:
+    API_URL = 'https://secure.diigo.com/api/v2/bookmarks'
+    RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+    def __init__(self, username, passwd, api_key, retries=5, backoff=1.0, requests_per_second=0, pool_size=10, timeout=60, api_url=API_URL, metrics=None):
+        self.api_url = api_url
+        self.metrics = metrics or SyncMetrics()
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, passwd)
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.params = {'key' : api_key, 'user' : username}
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.min_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self.next_request_time = 0
+        self.lock = threading.Lock()
+
+    def __throttle(self):
+        if not self.min_interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_request_time - now
+            self.next_request_time = max(now, self.next_request_time) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def __retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def request(self, method, params=None, json=None):
+        params = {**self.params, **(params or {})}
+        for attempt in range(self.retries + 1):
+            self.__throttle()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.api_url, params=params, json=json, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.add(f'http_failures:{method}')
+                if attempt == self.retries:
+                    raise
+                delay = self.__retry_delay(attempt)
+                logging.warning(f'{method} failed ({e}). Retrying in {delay}s.')
+                time.sleep(delay)
+                continue
+
+            self.metrics.observe(f'http:{method}', time.perf_counter() - started)
+            self.metrics.add(f'http_responses:{response.status_code}')
+            self.metrics.add('http_bytes_received', len(response.content))
+            self.metrics.add('http_bytes_sent', len(response.request.body or b''))
+
+            if response.status_code in self.RETRY_STATUS_CODES and attempt < self.retries:
+                delay = self.__retry_delay(attempt, response)
+                logging.warning(f'{method} returned {response.status_code}. Retrying in {delay}s.')
+                response.close()
+                time.sleep(delay)
+                continue
+
+            return response
+
+    def get(self, params):
+        return self.request('GET', params=params)
+
+    def post(self, bookmark, params=None):
+        return self.request('POST', params=params, json=bookmark)
+
+    def delete(self, bookmark):
+        return self.request('DELETE', json=bookmark)
+
   # {
   #*   "title":"Diigo API Help",
   #*   "url":"http://www.diigo.com/help/api.html",
@@ -122,34 +224,66 @@ spinner = itertools.cycle(['-', '\\', '|', '/'])
   #   "comments":[],
   #   "annotations":[]
   # },
+# a full sync makes one of these for every bookmark on diigo.com, so they're kept small: slots instead of a __dict__,
+# only the synced fields of what diigo.com sent, and everything else worked out when it's asked for
 class DiigoBookmark:
-    def __init__(self, downloaded_bookmark):
-
-        self.bookmark = downloaded_bookmark
+    __slots__ = ('syncer', 'bookmark', 'annotations', 'created_timestamp', 'modified_timestamp', 'has_changed', 'is_new',
+                 'short_id', 'content_hash', 'match', 'is_matched', '__file')
+
+    def __init__(self, syncer, downloaded_bookmark):
+        # imported here rather than at the top so that runs which never see a bookmark start faster
+        import shortuuid
+
+        self.syncer = syncer
+        self.bookmark = {field : downloaded_bookmark[field] for field in ['title', 'url', 'desc', 'tags']}
+        # 'yes' or 'no', so one copy of each will do
+        self.bookmark['shared'] = sys.intern(downloaded_bookmark['shared'])
+        self.bookmark['readlater'] = sys.intern(downloaded_bookmark['readlater'])
+        # highlights and comments are only needed to write the file, so they stay as the json they came in until then
+        annotations = downloaded_bookmark.get('annotations')
+        self.annotations = json.dumps(annotations, ensure_ascii=False, separators=(',', ':')) if annotations else None
+        self.__file = None
+        self.match = None
+        self.is_matched = False
+
+        self.created_timestamp = parse_diigo_timestamp(downloaded_bookmark['created_at'])
+        self.modified_timestamp = parse_diigo_timestamp(downloaded_bookmark['updated_at'])
+
+        self.has_changed = self.modified_timestamp > syncer.last_sync_time
 
-        self.created_timestamp = int(parser.parse(self.bookmark['created_at']).timestamp())
-        self.modified_timestamp = int(parser.parse(self.bookmark['updated_at']).timestamp())
+        self.short_id = datetime.fromtimestamp(self.created_timestamp).strftime('%y%m%d') + shortuuid.encode(self.full_id)[:4]
 
-        self.has_changed = self.modified_timestamp > last_sync_time
+        self.is_new = self.created_timestamp > syncer.last_sync_time
 
-        self.full_id = uuid.uuid5(uuid.NAMESPACE_URL, str(self.created_timestamp) + self.bookmark['url'])
-        self.short_id = datetime.fromtimestamp(self.created_timestamp).strftime('%y%m%d') + shortuuid.encode(self.full_id)[:4]
+        self.__convert_tag_string_to_tag_set()
+        self.__convert_shared_to_private()
 
-        self.folder = datetime.fromtimestamp(self.created_timestamp).strftime(cfg["options"]["subdirs"]) if cfg["options"]["subdirs"] else ''
+        self.content_hash = hashlib.blake2b(json.dumps([sorted(self.bookmark['tags']), self.bookmark['shared'], self.bookmark['readlater'],
+                                                        self.bookmark['title'], self.bookmark['url'], self.bookmark['desc']]).encode(), digest_size=8).hexdigest()
 
-        self.slug = slugify(self.bookmark['title']).replace("-", " ")[:80]
+        logline('Receiving', self, self.modified_timestamp, 'NEW' if self.is_new else '')
+        logging.debug('%s', downloaded_bookmark)
 
-        self.is_new = self.created_timestamp > last_sync_time
+    @property
+    def full_id(self):
+        return uuid.uuid5(uuid.NAMESPACE_URL, str(self.created_timestamp) + self.bookmark['url'])
 
-        self.logging_title = self.bookmark["url"][6:56].ljust(50)
+    @property
+    def folder(self):
+        subdirs = self.syncer.cfg["options"]["subdirs"]
+        return datetime.fromtimestamp(self.created_timestamp).strftime(subdirs) if subdirs else ''
 
-        self.__convert_tag_string_to_tag_set()
-        self.__convert_shared_to_private()
+    @property
+    def slug(self):
+        return slugify(self.bookmark['title']).replace("-", " ")[:80]
 
-        self.org_readlater = f'{cfg["options"]["todo_keyword"]} ' if self.bookmark['readlater'] == 'yes' else ''
+    @property
+    def logging_title(self):
+        return self.bookmark["url"][6:56].ljust(50)
 
-        logline('Receiving', self.logging_title, org_timestamp(self.modified_timestamp), 'NEW' if self.is_new else '')
-        logging.debug(self.bookmark)
+    @property
+    def org_readlater(self):
+        return f'{self.syncer.cfg["options"]["todo_keyword"]} ' if self.bookmark['readlater'] == 'yes' else ''
 
     def __convert_shared_to_private(self):
         self.bookmark['private'] = 'yes' if self.bookmark['shared'] == 'no' else 'yes'
@@ -166,210 +300,703 @@ class DiigoBookmark:
 
     @property
     def file(self):
-        if hasattr(self, '__file'):
+        if self.__file:
             return self.__file
 
         # first see if file we expect exists
-        # if not, search for it by suuid, and if found, rename it
+        # if not, look it up by suuid, and if found, rename it
         # if not found, return ideal name
-        dir = os.path.join(args.dir, self.folder)
+        local_files = self.syncer.local_files
+        dir = os.path.join(self.syncer.dir, self.folder)
         correct_filename =  os.path.join( dir, self.short_id + FILENAME_DELIMITER + self.slug + ".org")
-        if os.path.exists(correct_filename):
-            return correct_filename
-        else:
-            for file in glob.iglob(dir + '**/*.org', recursive=True):
-                if os.path.basename(file).startswith(self.short_id):
-                    os.rename(file, correct_filename)
-                    return correct_filename
-            self.__file = correct_filename
-            return self.__file
-
-
-    def _tags_to_org_string(self):
-        if self.bookmark['tags']:
-            for tag in self.bookmark['tags']:
-                self.bookmark['tags'] = [re.sub('[^A-Za-z0-9@]+', '_', tag) for tag in self.bookmark['tags']]
-
-            return ':' + ':'.join(self.bookmark['tags']) + ':'
-        else:
-            return ''
+        if not os.path.exists(correct_filename):
+            existing_file = local_files.find(self.short_id)
+            if existing_file and os.path.exists(existing_file):
+                os.makedirs(dir, exist_ok=True)
+                os.rename(existing_file, correct_filename)
+                # or the next sync would take the old name for a file that was deleted
+                self.syncer.manifest.forget(existing_file)
+
+        local_files.add(self.short_id, correct_filename)
+        self.__file = correct_filename
+        return self.__file
 
     def write_bookmark_file(self):
-        global num_dl
         os.makedirs(os.path.dirname(self.file), exist_ok=True)
-        with open(self.file, "w") as f:
-            f.write(self.__create_bookmark_file_synced_section())
-            num_dl += 1
+        text = self.__create_bookmark_file_synced_section()
+        content = text.encode('utf-8')
+        # they're in the file now, and nothing else needs them
+        self.annotations = None
+
+        if os.path.exists(self.file):
+            with open(self.file, 'rb') as f:
+                existing = f.read()
+            self.syncer.metrics.add('file_bytes_read', len(existing))
+            if existing == content:
+                # leave the file and its mtime alone
+                self.syncer.tally('num_unchanged')
+                return f'Unchanged {self.file}'
+
+        self.syncer.metrics.add('file_bytes_written', write_file_atomically(self.file, content))
+        self.syncer.synced(self.file, parse_org_text(text, self.syncer.cfg["options"]["todo_keyword"]))
+        self.syncer.tally('num_dl')
 
         return f'Saved {self.file}'
 
     def __create_bookmark_file_synced_section(self):
-        bm = self.bookmark
-
-        query = slugify(bm['title']).replace("-", "+")[:30]
-        query = query[:query.rfind('+')]
-        query_link = f'https://diigo.com/user/{cfg["diigo_credentials"]["username"]}?query={query}'
-
-        buf = ''
-        if cfg.getboolean('file_properties','title',fallback=False):
-            buf += f'#+TITLE: {bm["title"]}\n'
-
-        if cfg.getboolean('file_properties','diigo_search_link',fallback=False):
-            buf += f'#+DIIGO_LINK: {query_link}\n'
-
-        if cfg.getboolean('file_properties','tags',fallback=False):
-            buf += f'#+FILETAGS: {self._tags_to_org_string()}\n'
-
-        if cfg.getboolean('file_properties','roam_refs',fallback=False):
-            buf += f'#+ROAM_REFS: {bm["url"]}\n'
-
-        buf += f'* {self.org_readlater}[[{bm["url"]}][{bm["title"]}]]'
-
-        if cfg.getboolean('heading_properties','tags',fallback=True):
-            buf += f' {self._tags_to_org_string()}'
-
-        buf += '\n'
-        buf += ':PROPERTIES:\n'
-
-        if cfg.getboolean('heading_properties','diigo_search_link',fallback=False):
-            buf += f':DIIGO_LINK:{query_link}\n'
-
-        buf += f':CREATED: {org_timestamp(self.created_timestamp)}\n'
-        buf += f':UPDATED: {org_timestamp(self.modified_timestamp)}\n'
-
-        if cfg.getboolean('heading_properties','org_id',fallback=False):
-            buf += f':ID: {self.full_id}\n'
-
-        if cfg.getboolean('heading_properties','roam_refs',fallback=False):
-            buf += f':ROAM_REFS: {bm["url"]}\n'
-
-        buf += f':ID2: {self.short_id}\n'
-        buf += f':PRIVATE: {bm["private"]}\n'
-        buf += ":END:\n"
-        buf += f'{bm["desc"]}'
-
-        if bm['annotations']:
-            # buf += '\n'
-            for annot in bm['annotations']:
-                # buf += '** Highlight\n'
-                # buf += '#+Editing of highlights and comments can only be done on Diigo.com\n'
-                # buf += f'#+{query_link}\n'
-                # buf += '#+BEGIN_QUOTE\n')
-                buf += '#+BEGIN_SRC html\n'
-                buf += f'{annot["content"]}\n'
-                buf += '#+END_SRC\n'
-                # buf += '#+END_QUOTE\n')
-
-                if annot['comments']:
-                    # buf += '*** Comments\n'
-                    for comment in annot['comments']:
-                        buf += '#+BEGIN_QUOTE\n'
-                        buf += f'{comment["content"]}\n'
-                        buf += f'-- {comment["user"]}, '
-                        buf += f'{comment["created_at"]}\n'
-                        buf += '#+END_QUOTE\n'
-
-        if cfg.getboolean('options', 'notes_section', fallback=True):
-            buf += '* Notes\n'
-
-        return buf
+        return self.syncer.renderer.render(self)
 
     def update_bookmark_file(self):
-        "update an existing local bookmark with changes from the server"
-        global num_dl
-        file_object = open(self.file, 'r')
-        source_buffer = file_object.readlines()
-        file_object.close()
-
-        new_buffer = self.__create_bookmark_file_synced_section()
-
-        root = orgparse.loadi(source_buffer)
-
-        if len(root.children) > 1:
-            start_copy_line = root.children[1].linenumber
-
-            for idx, line in enumerate(source_buffer):
-                if idx >= start_copy_line:
-                    new_buffer += line
+        "update an existing local bookmark with changes from the server. Returns the fields it wrote, or None if nothing changed"
+        todo_keyword = self.syncer.cfg["options"]["todo_keyword"]
+        text = self.__create_bookmark_file_synced_section()
+        new_head = text.encode('utf-8')
+        self.annotations = None
+
+        # find where the synced section ends without reading any further than that
+        with open(self.file, 'rb') as f:
+            head_lines = []
+            line_ends = []
+            def lines():
+                for line in f:
+                    head_lines.append(line)
+                    line_ends.append((line_ends[-1] if line_ends else 0) + len(line))
+                    yield line.decode('utf-8')
+
+            header = read_org_header(lines(), todo_keyword)
+            if not header:
+                f.seek(0)
+                head_lines.clear()
+                line_ends.clear()
+                header = read_org_header_with_orgparse(list(lines()), todo_keyword)
+        fields, tail_line = header
+        self.syncer.metrics.add('file_bytes_read', line_ends[-1] if line_ends else 0)
+
+        # the synced section ends with a '* Notes' heading of its own, which replaces the old second heading
+        tail_offset = line_ends[tail_line] if tail_line is not None else None
+        old_head = b''.join(head_lines[:tail_line + 1] if tail_line is not None else head_lines)
+        if old_head == new_head:
+            # nothing would change, so leave the file and its mtime alone
+            self.syncer.tally('num_unchanged')
+            return
 
-        file_object = open(self.file, 'w')
-        file_object.write(new_buffer)
-        file_object.close()
-        num_dl += 1
+        self.syncer.metrics.add('file_bytes_written', write_file_atomically(self.file, new_head, tail_offset))
+        # the rest of the file is past the synced section, so what's in it doesn't change the fields
+        fields = parse_org_text(text, todo_keyword)
+        self.syncer.synced(self.file, fields)
+        self.syncer.tally('num_dl')
+        return fields
+
+    def regenerate_bookmark_file(self):
+        "update_bookmark_file() from the library. The file keeps its mtime, so that the next sync doesn't take the rewrite for an edit"
+        stat = os.stat(self.file)
+        fields = self.update_bookmark_file()
+        if fields is not None:
+            os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.syncer.synced(self.file, fields)
 
     def __convert_tags_org2diigo(self):
         self.bookmark['tags'] = (',').join(self.bookmark['tags'])
 
+    def raw_bookmark(self):
+        "the bookmark as diigo.com sent it, so it can be stored and turned back into a DiigoBookmark later"
+        raw = dict(self.bookmark)
+        if not isinstance(raw['tags'], str):
+            raw['tags'] = ','.join(sorted(raw['tags']))
+        raw.pop('private', None)
+        raw['created_at'] = datetime.fromtimestamp(self.created_timestamp, timezone.utc).strftime('%Y/%m/%d %H:%M:%S +0000')
+        raw['updated_at'] = datetime.fromtimestamp(self.modified_timestamp, timezone.utc).strftime('%Y/%m/%d %H:%M:%S +0000')
+        raw['annotations'] = json.loads(self.annotations) if self.annotations else []
+        return raw
+
+    def to_journal(self):
+        return {'bookmark' : self.raw_bookmark()}
+
     def delete_remote_bookmark(self, reason='local bookmark was deleted.'):
-        global num_del
         self.__convert_tags_org2diigo()
-        num_del += 1
-        if not args.safe:
+        self.syncer.tally('num_del')
+        if not self.syncer.args.safe:
             print( 'deleting on server:', self.bookmark['title'], ':', reason )
-            url = f'https://secure.diigo.com/api/v2/bookmarks?key={cfg["diigo_credentials"]["api_key"]}&user={cfg["diigo_credentials"]["username"]}'
-            response = requests.delete(url, auth=HTTPBasicAuth(cfg["diigo_credentials"]["username"], cfg["diigo_credentials"]['passwd']), json=self.bookmark)
+            response = self.syncer.diigo.delete(self.bookmark)
             response.close()
             return response.json()
         else:
             print( 'Would be deleting ', self.bookmark['title'], reason )
 
+# these follow orgparse, so that read_org_header() sees a file the same way it does
+ORG_NODE_HEADER_RE = re.compile(r'^\*+ ')
+ORG_HEADING_RE = re.compile(r'^(\*+)\s+(.*?)\s*$')
+ORG_HEADING_TAGS_RE = re.compile(r'(.*?)\s*:([\w@:]+):\s*$')
+ORG_HEADING_PRIORITY_RE = re.compile(r'^\s*\[#([A-Z0-9])\] ?(.*)$')
+ORG_PROPERTY_RE = re.compile(r'^\s*:(.*?):\s*(.*?)\s*$')
+ORG_SPECIAL_COMMENT_RE = re.compile(r'\s*#\+')
+# things orgparse treats specially that read_org_header() leaves to it
+ORG_UNHANDLED_RE = re.compile(r'SCHEDULED:|DEADLINE:|CLOSED:|CLOCK:|-\s+State\s|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+# what diigorg.cfg says goes into the synced section of an org file, worked out once per config rather than once per file.
+# The section is a single str.format() template, with the highlights and comments joined on after it.
+class BookmarkRenderer:
+    def __init__(self, cfg):
+        def on(section, option, fallback=False):
+            return cfg.getboolean(section, option, fallback=fallback)
+
+        self.username = cfg["diigo_credentials"]["username"]
+        self.todo_keyword = cfg["options"]["todo_keyword"]
+
+        segments = []
+        if on('file_properties', 'title'):
+            segments.append('#+TITLE: {title}\n')
+        if on('file_properties', 'diigo_search_link'):
+            segments.append('#+DIIGO_LINK: {query_link}\n')
+        if on('file_properties', 'tags'):
+            segments.append('#+FILETAGS: {tags}\n')
+        if on('file_properties', 'roam_refs'):
+            segments.append('#+ROAM_REFS: {url}\n')
+
+        segments.append('* {readlater}[[{url}][{title}]]')
+        if on('heading_properties', 'tags', fallback=True):
+            segments.append(' {tags}')
+        segments.append('\n:PROPERTIES:\n')
+
+        if on('heading_properties', 'diigo_search_link'):
+            segments.append(':DIIGO_LINK:{query_link}\n')
+        segments.append(':CREATED: {created}\n:UPDATED: {updated}\n')
+        if on('heading_properties', 'org_id'):
+            segments.append(':ID: {full_id}\n')
+        if on('heading_properties', 'roam_refs'):
+            segments.append(':ROAM_REFS: {url}\n')
+        segments.append(':ID2: {short_id}\n:PRIVATE: {private}\n:END:\n{desc}')
+        self.template = ''.join(segments)
+
+        # the fields that take some work are only worked out when the template has a place for them
+        self.needs_query_link = '{query_link}' in self.template
+        self.needs_tags = '{tags}' in self.template
+        self.needs_full_id = '{full_id}' in self.template
+        self.notes = '* Notes\n' if on('options', 'notes_section', fallback=True) else ''
+
+    def query_link(self, title):
+        query = slugify(title).replace("-", "+")[:30]
+        query = query[:query.rfind('+')]
+        return f'https://diigo.com/user/{self.username}?query={query}'
+
+    @staticmethod
+    def tags(tags):
+        # sorted, so that the same bookmark always comes out the same and an unchanged file can be left alone
+        return ':' + ':'.join(sorted(org_tag(tag) for tag in tags)) + ':' if tags else ''
+
+    def render(self, rbm):
+        "the synced section of `rbm`'s org file"
+        bm = rbm.bookmark
+        parts = [self.template.format(
+            title = bm['title'],
+            url = bm['url'],
+            desc = bm['desc'],
+            private = bm['private'],
+            readlater = f'{self.todo_keyword} ' if bm['readlater'] == 'yes' else '',
+            tags = self.tags(bm['tags']) if self.needs_tags else '',
+            query_link = self.query_link(bm['title']) if self.needs_query_link else '',
+            full_id = rbm.full_id if self.needs_full_id else '',
+            created = org_timestamp(rbm.created_timestamp),
+            updated = org_timestamp(rbm.modified_timestamp),
+            short_id = rbm.short_id)]
+
+        if rbm.annotations:
+            for annot in json.loads(rbm.annotations):
+                parts += ['#+BEGIN_SRC html\n', annot['content'], '\n#+END_SRC\n']
+                for comment in annot['comments'] or []:
+                    parts += ['#+BEGIN_QUOTE\n', comment['content'], '\n-- ', comment['user'], ', ', comment['created_at'], '\n#+END_QUOTE\n']
+
+        parts.append(self.notes)
+        return ''.join(parts)
+
+def read_org_header(lines, todo_keyword):
+    """
+    Read the synced first heading of an org bookmark file without parsing the rest of it.
+    `lines` can be an open file. It's only read up to the next top-level heading.
+    Returns (fields, tail_line), where tail_line is the 0-based line number of that next heading or None,
+    or returns None if the file needs orgparse.
+    """
+    filetags = []
+    heading = None
+    heading_level = 0
+    body_lines = []
+    in_first_node = False
+    tail_line = None
+
+    for number, line in enumerate(lines):
+        line = line.rstrip('\n')
+        if ORG_UNHANDLED_RE.search(line):
+            return None
+
+        if ORG_NODE_HEADER_RE.match(line):
+            level = len(line) - len(line.lstrip('*'))
+            if heading is None:
+                heading, heading_level, in_first_node = line, level, True
+                continue
+            in_first_node = False
+            if level <= heading_level:
+                tail_line = number
+                break
+            continue
+
+        if ORG_SPECIAL_COMMENT_RE.match(line):
+            comment = line[ORG_SPECIAL_COMMENT_RE.match(line).end():].split(':', maxsplit=1)
+            if len(comment) == 2:
+                key = comment[0].upper()
+                if key in ['TODO', 'SEQ_TODO', 'TYP_TODO']:
+                    # these change the todo keywords
+                    return None
+                if key == 'FILETAGS' and heading is None:
+                    filetags += [tag.strip() for tag in comment[1].strip().split(':') if tag.strip()]
+
+        if in_first_node:
+            body_lines.append(line)
+
+    if heading is None:
+        return {}, None
+
+    text = ORG_HEADING_RE.search(heading).group(2)
+    tags = []
+    if match := ORG_HEADING_TAGS_RE.search(text):
+        text, tags = match.group(1), match.group(2).split(':')
+    todo = None
+    for keyword in [todo_keyword, 'DONE']:
+        if text == keyword or text.startswith(keyword + ' '):
+            text, todo = text[len(keyword) + 1:], keyword
+            break
+    if match := ORG_HEADING_PRIORITY_RE.search(text):
+        text = match.group(2)
+
+    # the first property drawer belongs to the heading. Everything else is its body
+    properties = {}
+    body = []
+    ilines = iter(body_lines)
+    for line in ilines:
+        if line.find(':PROPERTIES:') >= 0:
+            for line in ilines:
+                if line.find(':END:') >= 0:
+                    break
+                if match := ORG_PROPERTY_RE.search(line):
+                    properties[match.group(1)] = match.group(2)
+            body += ilines
+        else:
+            body.append(line)
+
+    from orgparse.inline import to_plain_text
+
+    fields = {
+        'title' : text[text.rfind("][")+2:text.rfind("]")-1],
+        'url' : text[text.find("[")+2:text.find("]")],
+        'tags' : set(tags) | set(filetags),
+        'desc' : to_plain_text('\n'.join(body)),
+        'private' : properties.get('PRIVATE'),
+        'readlater' : 'yes' if todo != None else 'no',
+        'full_id' : properties.get('ID'),
+        'node_short_id' : properties.get('ID2'),
+    }
+    return fields, tail_line
+
+def read_org_header_with_orgparse(source, todo_keyword):
+    "the thorough version of read_org_header(). `source` is a path or a list of lines"
+    import orgparse
+    if isinstance(source, str):
+        root = orgparse.load(source, env=orgparse.OrgEnv(todos=[todo_keyword], filename=source))
+    else:
+        root = orgparse.loadi(source, env=orgparse.OrgEnv(todos=[todo_keyword], filename='<lines>'))
+
+    node = root.children[0] if root.children else None
+    tail_line = root.children[1].linenumber - 1 if len(root.children) > 1 else None
+    if not node:
+        return {}, tail_line
+
+    h = node.get_heading(format='raw')
+    fields = {
+        'title' : h[h.rfind("][")+2:h.rfind("]")-1],
+        'url' : h[h.find("[")+2:h.find("]")],
+        'tags' : node.tags,
+        'desc' : node.body,
+        'private' : node.get_property('PRIVATE'),
+        'readlater' : 'yes' if node.todo != None else 'no',
+        'full_id' : node.get_property('ID'),
+        'node_short_id' : node.get_property('ID2'),
+    }
+    return fields, tail_line
+
+def parse_org_file(file, todo_keyword):
+    "read the synced first heading of an org bookmark file. Returns (fields, bytes read)"
+    # newline='' keeps any \r around for read_org_header to notice
+    with open(file, 'r', encoding='utf-8', newline='') as f:
+        header = read_org_header(f, todo_keyword)
+        # as far as the buffer got, which is what came off the disk
+        bytes_read = f.buffer.tell()
+    if not header:
+        header = read_org_header_with_orgparse(file, todo_keyword)
+        bytes_read += os.path.getsize(file)
+    return header[0], bytes_read
+
+def parse_org_text(text, todo_keyword):
+    "parse_org_file() for the synced section of a file that a sync has just written, while it's still in memory. Returns the fields"
+    lines = text.splitlines(keepends=True)
+    header = read_org_header(lines, todo_keyword) or read_org_header_with_orgparse(lines, todo_keyword)
+    return header[0]
+
+def parse_org_files(files, todo_keyword):
+    "parse_org_file() for each of `files`. Run in the worker processes of Syncer.parse_local_bookmarks()"
+    return [parse_org_file(file, todo_keyword) for file in files]
+
+def write_file_atomically(path, head, tail_offset=None):
+    """
+    Replace `path` with `head`, followed by what's in the current file from byte `tail_offset` on, if given.
+    The new file is written next to the old one and moved over it, so a crash leaves one or the other.
+    Returns the number of bytes written.
+    """
+    temp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp')
+    # like open(path, 'w'), the permissions come from the umask
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            temp.write(head)
+            if tail_offset is not None:
+                with open(path, 'rb') as source:
+                    source.seek(tail_offset)
+                    shutil.copyfileobj(source, temp)
+            temp.flush()
+            os.fsync(temp.fileno())
+            written = temp.tell()
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+        return written
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def short_id_from_filename(file):
+    basename = os.path.basename(file)
+    return basename[0:basename.find(FILENAME_DELIMITER)]
+
+# short_id -> path of every org file in the bookmarks directory. It's built from one walk of the tree,
+# so that bookmarks whose files were renamed or retitled can be found without searching for each one.
+class LocalFileIndex:
+    def __init__(self, root):
+        self.root = root
+        self.paths = None
+        self.lock = threading.Lock()
+
+    def fill(self, files):
+        "use the files found by a walk that already happened"
+        with self.lock:
+            self.paths = {short_id_from_filename(file) : file for file in files}
+
+    def __build(self):
+        if self.paths is None:
+            self.paths = {short_id_from_filename(file) : file for file in glob.iglob(self.root + '**/*.org', recursive=True)}
+
+    def find(self, short_id):
+        with self.lock:
+            self.__build()
+            return self.paths.get(short_id)
+
+    def files(self):
+        with self.lock:
+            self.__build()
+            return list(self.paths.values())
+
+    def add(self, short_id, file):
+        with self.lock:
+            if self.paths is not None:
+                self.paths[short_id] = file
+
+    def remove(self, short_id, file):
+        with self.lock:
+            if self.paths is not None and self.paths.get(short_id) == file:
+                del self.paths[short_id]
+
+# a cache of the fields parsed out of each local org file, keyed by path.
+# An entry is only trusted while the file's mtime and size are unchanged.
+class LocalManifest:
+    FIELDS = ['title', 'url', 'tags', 'desc', 'private', 'readlater', 'full_id', 'node_short_id']
+
+    def __init__(self, path, todo_keyword):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, short_id TEXT, '
+                        + ', '.join(f'{field} TEXT' for field in self.FIELDS) + ')')
+
+        # readlater depends on the todo keyword, so a different keyword invalidates everything
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'todo_keyword'").fetchone()
+        if not row or row[0] != todo_keyword:
+            self.db.execute('DELETE FROM files')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('todo_keyword', ?)", (todo_keyword,))
+            # rather than holding the write lock until save(), which would lock out any other Syncer on this directory
+            self.db.commit()
+
+        self.entries = {row[0]: row[1:] for row in self.db.execute('SELECT * FROM files')}
+        self.dirty = {}
+        self.gone = set()
+        # the scheduler's workers store and forget files while the main thread may be saving
+        self.lock = threading.Lock()
+
+        # path -> mtime_ns of files a sync wrote or uploaded without moving the last sync time on
+        self.db.execute('CREATE TABLE IF NOT EXISTS settled (path TEXT PRIMARY KEY, mtime_ns INTEGER)')
+        self.settled = dict(self.db.execute('SELECT * FROM settled'))
+        self.settled_changed = False
+
+    def __fields(self, entry):
+        fields = dict(zip(self.FIELDS, entry[3:]))
+        if fields['tags'] is not None:
+            fields['tags'] = set(json.loads(fields['tags']))
+        return fields
+
+    def fields(self, path):
+        "the fields a file had when it was last parsed, whether or not it has changed since"
+        entry = self.entries.get(path)
+        return self.__fields(entry) if entry else None
+
+    def lookup(self, path, mtime_ns, size):
+        entry = self.entries.get(path)
+        if not entry or entry[0] != mtime_ns or entry[1] != size:
+            return None
+        return self.__fields(entry)
+
+    def forget(self, path):
+        "drop the entry of a file that's gone. Returns the fields it had, if there was one"
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            self.dirty.pop(path, None)
+            if not entry:
+                return None
+            self.gone.add(path)
+        return self.__fields(entry)
+
+    def store(self, path, mtime_ns, size, short_id, fields):
+        fields = dict(fields)
+        if fields.get('tags') is not None:
+            fields['tags'] = json.dumps(sorted(fields['tags']))
+        entry = (mtime_ns, size, short_id) + tuple(fields.get(field) for field in self.FIELDS)
+        with self.lock:
+            self.entries[path] = entry
+            self.dirty[path] = entry
+            self.gone.discard(path)
+
+    def settle(self, path, mtime_ns):
+        "take a file that's newer than the last sync as synced, as long as it stays at `mtime_ns`"
+        with self.lock:
+            self.settled[path] = mtime_ns
+            self.settled_changed = True
+
+    def is_settled(self, path, mtime_ns):
+        return self.settled.get(path) == mtime_ns
+
+    def unsettle_all(self):
+        "the last sync time has moved past everything that was settled"
+        with self.lock:
+            if self.settled:
+                self.settled = {}
+                self.settled_changed = True
+
+    def save(self):
+        # take what's been recorded so far, so that anything a worker records while this writes waits for the next save
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            gone, self.gone = self.gone, set()
+            settled = list(self.settled.items()) if self.settled_changed else None
+            self.settled_changed = False
+
+        if settled is not None:
+            self.db.execute('DELETE FROM settled')
+            self.db.executemany('INSERT INTO settled VALUES (?, ?)', settled)
+        self.db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in gone])
+        self.db.executemany(f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * (len(self.FIELDS) + 4))})',
+                            [(path,) + entry for path, entry in dirty.items()])
+        self.db.commit()
+
+# short_id -> content hash of each diigo.com bookmark as of the last sync.
+# Tag, readlater and privacy changes on diigo.com don't touch updated_at, so a full sync uses this
+# to only compare the bookmarks whose content actually changed since then.
+class RemoteSnapshot:
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    short_id, content_hash = line.split()
+                    self.hashes[short_id] = content_hash
+        except (FileNotFoundError, ValueError):
+            self.hashes = {}
+
+    def is_unchanged(self, rbm):
+        return self.hashes.get(rbm.short_id) == rbm.content_hash
+
+    def save(self, fetched, replace, forget_ids, covers=None):
+        "record the fetched bookmarks' short_id -> content hash. `replace` drops everything that wasn't fetched, or everything `covers` that wasn't."
+        if replace:
+            self.hashes = {short_id : content_hash for short_id, content_hash in self.hashes.items() if covers and not covers(short_id)}
+        self.hashes.update(fetched)
+        for short_id in forget_ids:
+            self.hashes.pop(short_id, None)
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.writelines(f'{short_id} {content_hash}\n' for short_id, content_hash in self.hashes.items())
+        os.replace(temp_path, self.path)
+
+# short_id -> every diigo.com bookmark as the API last sent it, highlights and comments included.
+# Each sync keeps it up to date with what it fetched and uploaded, so that after a change to diigorg.cfg
+# the org files can be rewritten from here instead of fetching the whole library again.
+# It's complete once a full sync has replaced it, and only the main thread uses it.
+class RemoteLibrary:
+    BATCH_SIZE = 1000
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS bookmarks (short_id TEXT PRIMARY KEY, version TEXT, raw TEXT)')
+        self.db.commit()
+        self.pending = []
+        self.gone = set()
+
+    @property
+    def complete(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return bool(row) and row[0] == 'yes'
+
+    @staticmethod
+    def version(rbm):
+        "changes whenever anything diigorg writes to the org file does, so unchanged bookmarks needn't be stored again"
+        annotations_hash = hashlib.blake2b(rbm.annotations.encode(), digest_size=8).hexdigest() if rbm.annotations else ''
+        return f'{rbm.modified_timestamp} {rbm.content_hash} {annotations_hash}'
+
+    def add(self, rbm, raw):
+        "keep `raw`, the json `rbm` was made from, unless this version of it is already kept"
+        version = self.version(rbm)
+        row = self.db.execute('SELECT version FROM bookmarks WHERE short_id = ?', (rbm.short_id,)).fetchone()
+        if row and row[0] == version:
+            return
+        self.__keep(rbm.short_id, version, raw)
+
+    def uploading(self, short_id, fields):
+        "update a kept bookmark with the fields of the org file that's about to be uploaded over it"
+        row = self.db.execute('SELECT raw FROM bookmarks WHERE short_id = ?', (short_id,)).fetchone()
+        if not row or fields.get('title') is None:
+            return
+        raw = json.loads(row[0])
+        raw.update(title=fields['title'], url=fields['url'], desc=fields['desc'], readlater=fields['readlater'],
+                   tags=','.join(sorted(fields['tags'] or [])))
+        # no version, so that it's replaced by whatever diigo.com sends back for it next time
+        self.__keep(short_id, '', raw)
+
+    def forget(self, short_id):
+        self.gone.add(short_id)
+
+    def __keep(self, short_id, version, raw):
+        self.gone.discard(short_id)
+        self.pending.append((short_id, version, json.dumps(raw, ensure_ascii=False, separators=(',', ':'))))
+        if len(self.pending) >= self.BATCH_SIZE:
+            # a full first sync would otherwise hold the json of the whole library until the end
+            self.flush()
+
+    def flush(self):
+        self.db.executemany('INSERT OR REPLACE INTO bookmarks VALUES (?, ?, ?)', self.pending)
+        self.db.commit()
+        self.pending = []
+
+    def save(self, replace=False, kept=(), covers=None):
+        """
+        write what's pending. `replace` drops every bookmark that isn't in `kept` and marks the library complete,
+        or, with `covers`, only drops the ones it covers.
+        """
+        self.flush()
+        gone = set(self.gone)
+        if replace:
+            kept = set(kept)
+            gone.update(short_id for (short_id,) in self.db.execute('SELECT short_id FROM bookmarks')
+                        if short_id not in kept and (covers is None or covers(short_id)))
+            if covers is None:
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', 'yes')")
+        self.db.executemany('DELETE FROM bookmarks WHERE short_id = ?', [(short_id,) for short_id in gone])
+        self.db.commit()
+        self.gone = set()
+
+    def raw_bookmarks(self):
+        # a batch at a time, and no query left open in between, since whoever takes them may add to the library
+        last = ''
+        while rows := self.db.execute('SELECT short_id, raw FROM bookmarks WHERE short_id > ? ORDER BY short_id LIMIT ?',
+                                      (last, self.BATCH_SIZE)).fetchall():
+            for last, raw in rows:
+                yield json.loads(raw)
+
 # a class for local bookmark files. We don't open the file unless we have to.
+# Like DiigoBookmark, there's one for every org file in a full sync, so it has slots, it keeps only the parts
+# of the file's stat that it uses, and bookmark stays None until it's parsed.
 class OrgBookmark:
-    def __init__(self, file):
+    __slots__ = ('syncer', 'file', 'short_id', 'match', 'is_matched', 'full_id', 'node_short_id', 'modified_timestamp', 'mtime_ns', 'size',
+                 'bookmark', 'has_changed')
+
+    def __init__(self, syncer, file):
+        self.syncer = syncer
         self.file = file
         self.short_id = self.get_short_id_from_file()
+        self.match = None
+        self.is_matched = False
         self.full_id = None
-        self.node = None
-        self.modified_timestamp = os.path.getmtime(self.file)
-        self.bookmark = {}
-        self.has_changed = self.modified_timestamp > last_sync_time
-        self.logging_title = f'"{os.path.basename(self.file)[:50].ljust(50)}"'
+        self.node_short_id = None
+        stat = os.stat(self.file)
+        self.modified_timestamp = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.bookmark = None
+        self.has_changed = self.modified_timestamp > syncer.last_sync_time and not syncer.manifest.is_settled(file, self.mtime_ns)
+
+        logline('Local', self, self.modified_timestamp, (lambda: f'CHANGED {syncer.last_sync_time}') if self.has_changed else '')
+
+    @property
+    def is_parsed(self):
+        return self.bookmark is not None
 
-        logline('Local', self.logging_title, org_timestamp(self.modified_timestamp), f"CHANGED {last_sync_time}" if self.has_changed else "")
+    @property
+    def logging_title(self):
+        return f'"{os.path.basename(self.file)[:50].ljust(50)}"'
 
     def is_an_org_bookmark(self):
-        self.parse_and_fill_out()
-        return self.node and self.get_node_short_id()
+        return self.get_node_short_id()
 
     def get_short_id_from_file(self):
-        basename = os.path.basename(self.file)
-        return basename[0:basename.find(FILENAME_DELIMITER)]
+        return short_id_from_filename(self.file)
 
     def get_node_title(self):
         self.parse_and_fill_out()
-        h = self.node.get_heading(format='raw')
-        title = h[h.rfind("][")+2:h.rfind("]")-1]
-        return title
+        return self.bookmark.get('title')
 
     def get_node_url(self):
         self.parse_and_fill_out()
-        h = self.node.get_heading(format='raw')
-        url = h[h.find("[")+2:h.find("]")]
-        return url
+        return self.bookmark.get('url')
 
     def get_node_tags(self):
         self.parse_and_fill_out()
-        # print(self.node.shallow_tags)
-        return self.node.tags
+        return self.bookmark.get('tags')
 
     def get_node_desc(self):
         self.parse_and_fill_out()
-        return self.node.body
+        return self.bookmark.get('desc')
 
     def get_node_private(self):
         self.parse_and_fill_out()
-        return self.node.get_property('PRIVATE')
+        return self.bookmark.get('private')
 
     def get_node_full_id(self):
         self.parse_and_fill_out()
-        return self.node.get_property('ID')
+        return self.full_id
 
     def get_node_short_id(self):
         self.parse_and_fill_out()
-        return self.node.get_property('ID2')
+        return self.node_short_id
 
     def get_node_readlater(self):
-        return 'yes' if self.node.todo != None else 'no'
+        self.parse_and_fill_out()
+        return self.bookmark.get('readlater')
 
     def compare_to_match(self):
         return compare_bookmarks(self, self.match, comparison_fields = ['title', 'url', 'desc'])
@@ -378,22 +1005,37 @@ class OrgBookmark:
         return compare_bookmarks(self, self.match,  comparison_fields = ['tags', 'private', 'readlater'])
 
     def parse_and_fill_out(self):
-        if self.node:
+        if self.is_parsed:
             return
+        self.bookmark = {}
 
-        env = orgparse.OrgEnv(todos=[cfg["options"]["todo_keyword"]], filename=self.file)
-        root = orgparse.load(self.file, env=env)
-        self.node = root.children[0] if root.children else None
-        if not self.node:
+        manifest = self.syncer.manifest
+        metrics = self.syncer.metrics
+        cached = manifest.lookup(self.file, self.mtime_ns, self.size)
+        if cached:
+            metrics.add('manifest_hits')
+            self.__fill_out(cached)
             return
 
-        self.bookmark['title'] = self.get_node_title()
-        self.bookmark['url'] = self.get_node_url()
-        self.bookmark['tags'] = (self.get_node_tags())
-        self.bookmark['desc'] = self.get_node_desc()
-        self.bookmark['private'] = self.get_node_private()
-        self.bookmark['readlater'] = self.get_node_readlater()
-        self.full_id = self.get_node_full_id()
+        with metrics.timer('parse'):
+            fields, bytes_read = parse_org_file(self.file, self.syncer.cfg["options"]["todo_keyword"])
+        metrics.add('file_bytes_read', bytes_read)
+        self.fill_out_parsed(fields)
+
+    def fill_out_parsed(self, fields):
+        "fill out from `fields` that parse_org_file() just read from the file, and keep them in the manifest"
+        self.bookmark = {}
+        self.syncer.manifest.store(self.file, self.mtime_ns, self.size, self.short_id, fields)
+        self.__fill_out(fields)
+
+    def __fill_out(self, fields):
+        if fields.get('title') is None:
+            return
+
+        for field in ['title', 'url', 'tags', 'desc', 'private', 'readlater']:
+            self.bookmark[field] = fields[field]
+        self.full_id = fields['full_id']
+        self.node_short_id = fields['node_short_id']
 
     def fix_tags_for_upload(self):
         self.bookmark['tags'] = (',').join(self.bookmark['tags'])
@@ -402,31 +1044,133 @@ class OrgBookmark:
         self.bookmark['readLater'] = self.bookmark['readlater']
 
     def upload_bookmark(self, reason=''):
-        global num_ul
         self.parse_and_fill_out()
         self.fix_tags_for_upload()
         self.fix_readlater_for_upload()
-        url = f'https://secure.diigo.com/api/v2/bookmarks?key={cfg["diigo_credentials"]["api_key"]}&user={cfg["diigo_credentials"]["username"]}&merge=no'
-        if not args.safe:
+        if not self.syncer.args.safe:
             print( 'uploading ', self.bookmark['title'], reason )
-            response = requests.post(url, auth=HTTPBasicAuth(cfg["diigo_credentials"]["username"], cfg["diigo_credentials"]['passwd']), json=self.bookmark)
+            response = self.syncer.diigo.post(self.bookmark, params={'merge' : 'no'})
             response.close()
-            num_ul += 1
+            self.syncer.synced(self.file)
+            self.syncer.tally('num_ul')
             return response.json()
 
+    def to_journal(self):
+        return {'file' : self.file}
+
     def delete_local_bookmark(self):
-        global num_del
-        os.remove(self.file)
-        num_del += 1
+        # a resumed sync may try to delete a file that was already gone
+        if os.path.exists(self.file):
+            # keep hold of the title for print_plan()
+            self.parse_and_fill_out()
+            os.remove(self.file)
+        # so that a watcher doesn't take this for the user deleting it
+        self.syncer.manifest.forget(self.file)
+        self.syncer.local_files.remove(self.short_id, self.file)
+        self.syncer.tally('num_del')
+
+# an org file that was deleted since the last sync, as the manifest remembers it,
+# so that its bookmark can be deleted from diigo.com without a full sync
+class RemovedOrgBookmark:
+    def __init__(self, syncer, file, fields):
+        self.syncer = syncer
+        self.file = file
+        self.short_id = short_id_from_filename(file)
+        self.bookmark = {field : fields[field] for field in ['title', 'url', 'desc', 'private', 'readlater']}
+        self.bookmark['tags'] = set(fields['tags'] or [])
+        self.logging_title = f'"{os.path.basename(self.file)[:50].ljust(50)}"'
+
+    def to_journal(self):
+        return {'removed' : self.file, 'fields' : {**self.bookmark, 'tags' : sorted(self.bookmark['tags'])}}
+
+    def delete_remote_bookmark(self, reason='local bookmark was deleted.'):
+        bookmark = {**self.bookmark, 'tags' : ','.join(sorted(self.bookmark['tags']))}
+        self.syncer.tally('num_del')
+        if not self.syncer.args.safe:
+            print( 'deleting on server:', bookmark['title'], ':', reason )
+            response = self.syncer.diigo.delete(bookmark)
+            response.close()
+            if response.ok:
+                # until now, the next sync had to try again
+                self.syncer.manifest.forget(self.file)
+            return response.json()
+        else:
+            print( 'Would be deleting ', bookmark['title'], reason )
+
+SLUG_STRIP_RE = re.compile(r'[^\w\s-]')
+SLUG_HYPHENATE_RE = re.compile(r'[-\s]+')
+
+ORG_TAG_DISALLOWED_RE = re.compile('[^A-Za-z0-9@]+')
+
+@functools.lru_cache(maxsize=4096)
+def org_tag(tag):
+    "a diigo tag with the characters org doesn't allow in tags replaced. The same few tags come up again and again."
+    return ORG_TAG_DISALLOWED_RE.sub('_', tag)
+
+def slugify(value):
+    "the same as django's slugify, which diigorg used to import django for"
+    value = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    value = SLUG_STRIP_RE.sub('', value.lower())
+    return SLUG_HYPHENATE_RE.sub('-', value).strip('-_')
+
+DIIGO_TIMESTAMP_RE = re.compile(r'(\d{4})/(\d\d)/(\d\d) (\d\d):(\d\d):(\d\d) ([+-])(\d\d)(\d\d)$')
+
+def parse_diigo_timestamp(text):
+    "seconds since the epoch of a diigo created_at/updated_at, e.g. '2008/04/30 06:28:54 +0800'"
+    match = DIIGO_TIMESTAMP_RE.match(text)
+    if match:
+        year, month, day, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+        try:
+            timestamp = int(datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            pass
+        else:
+            offset = (int(offset_hours) * 60 + int(offset_minutes)) * 60
+            return timestamp - offset if sign == '+' else timestamp + offset
+
+    # not in the usual format, so let dateutil figure it out
+    from dateutil import parser
+    return int(parser.parse(text).timestamp())
 
 def org_timestamp(timestamp):
     return datetime.fromtimestamp(timestamp).strftime(ORG_TIMESTAMP_FORMAT)
 
-def find_matching_bookmark(bm_list, bm):
-    results = [item for item in bm_list if item.short_id == bm.short_id]
-    return results[0] if len(results) == 1 else None
+def index_bookmarks(bm_list, side=''):
+    """
+    map short_id -> bookmark. short_ids that appear more than once are reported and left out,
+    and so are org files whose names don't start with one, since they aren't bookmarks diigorg wrote.
+    """
+    index = {}
+    duplicates = set()
+    for bm in bm_list:
+        if not SHORT_ID_RE.fullmatch(bm.short_id):
+            continue
+        if bm.short_id in index:
+            duplicates.add(bm.short_id)
+        else:
+            index[bm.short_id] = bm
+
+    for short_id in sorted(duplicates):
+        del index[short_id]
+        print( f'WARNING: more than one {side} bookmark has the id {short_id}. They will be left alone until that is fixed.' )
+        logging.warning(f'duplicate {side} short_id {short_id}')
+
+    return index, duplicates
 
 def logline( action='', title='', timestamp='', status='' ):
+    """
+    log a line of the sync's progress at INFO. `title` can be a bookmark, `timestamp` a unix time and `status` a function
+    that returns it, and they're only turned into text if the line is logged
+    """
+    # a full sync makes a few of these for every bookmark, so don't build one that won't be logged
+    if not logging.root.isEnabledFor(logging.INFO):
+        return
+    if not isinstance(title, str):
+        title = title.logging_title
+    if not isinstance(timestamp, str):
+        timestamp = org_timestamp(timestamp)
+    if callable(status):
+        status = status()
     logging.info( f'{action.ljust(10)} {title.ljust(50)} {timestamp.ljust(10)} {status.ljust(10)}')
 
 
@@ -448,116 +1192,124 @@ def compare_bookmarks(bm1, bm2, comparison_fields):
 
     return diff
 
-if args.test:
-    FETCH_START = 0
-    FETCH_STOP_AT = 30
-    FETCH_COUNT_PER_TRANCHE = 20
-    FETCH_SORT = 1
-    print( "TESTING..." )
-else:
-    FETCH_START = 0
-    FETCH_STOP_AT = -1
-    FETCH_COUNT_PER_TRANCHE = 100
-    FETCH_SORT = 1
-
-def fetch_tranche(start):
-    if FETCH_STOP_AT >= 0 and start >= FETCH_STOP_AT:
-        return ''
-
-    url = f'https://secure.diigo.com/api/v2/bookmarks?key={cfg["diigo_credentials"]["api_key"]}&user={cfg["diigo_credentials"]["username"]}&filter=all&count={FETCH_COUNT_PER_TRANCHE}&start={start}&sort={FETCH_SORT}'
-    response = requests.get(url, auth=HTTPBasicAuth(cfg["diigo_credentials"]["username"], cfg["diigo_credentials"]['passwd']))
-
-    if response.status_code != 200:
-        print( "Error retrieving bookmarks from diigo.com" )
-        print( response.text )
-        exit()
-    # spinner
-    sys.stdout.write( next( spinner ) )
-    sys.stdout.flush()
-    sys.stdout.write('\b')
-
-    response.close()
-    return response.json()
-
 
-def fetch_diigo_bookmarks():
-
-    sys.stdout.write('\nFetching bookmarks...')
+# keeps two diigorgs from syncing the same directory at once, with an flock on a file in .diigorg.
+# It can be entered again by the same Syncer, e.g. by each sync() of a daemon that holds it throughout
+class SyncLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.acquire()
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.release()
+
+    def acquire(self):
+        try:
+            # imported here rather than at the top, since there's no fcntl on windows
+            import fcntl
+        except ImportError:
+            logging.warning('fcntl isn\'t available, so nothing stops another diigorg from syncing this directory at the same time')
+            return
 
-    start = FETCH_START
-    done = False
-    while bookmarks_tranche := fetch_tranche(start=start):
-        for b in bookmarks_tranche:
-            entry = DiigoBookmark(b)
-            if args.full_sync or entry.has_changed:
-                remote_bookmark_list.append(entry)
-            elif not args.full_sync and not entry.has_changed:
-                done = True
+        self.file = open(self.path, 'a+')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.file.seek(0)
+            pid = self.file.read().strip()
+            self.file.close()
+            self.file = None
+            raise SyncError(f'Another diigorg{f" (pid {pid})" if pid else ""} is already syncing {os.path.dirname(os.path.dirname(self.path))}. '
+                            'Wait for it to finish, or stop it first.')
+
+        # for the message above, in the diigorg that comes next
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(str(os.getpid()))
+        self.file.flush()
+
+    def release(self):
+        if self.file:
+            # closing it lets go of the flock. The file stays, since removing it would let a third diigorg lock a new one
+            self.file.close()
+            self.file = None
+
+# the tranches fetched so far by a full sync, so that an interrupted one can carry on where it stopped
+class FetchCheckpoint:
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, path, page_size):
+        self.path = path
+        self.page_size = page_size
+        self.file = None
+
+    def load(self):
+        """
+        returns (started, next_start) from a recent checkpoint of a fetch that was interrupted, or None.
+        A fetch that finished is no use: whatever stopped its sync from getting further, like a plan that was turned down,
+        would leave the next full sync with a stale copy of the library
+        """
+        try:
+            with open(self.path, 'r') as f:
+                header = json.loads(f.readline())
+                if header['page_size'] != self.page_size or time.time() - header['started'] > self.MAX_AGE:
+                    return None
+
+                next_start = header['start']
+                for record in self.__records(f):
+                    if 'complete' in record:
+                        return None
+                    next_start = record['start'] + self.page_size
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+        return header['started'], next_start
+
+    def __records(self, f):
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may have been cut off
                 break
-        if done:
-            break
-        else:
-            start += 100
-
-    sys.stdout.write('\n')
-
-def delete_all_local_bookmarks():
-    proceed('About to delete all local bookmarks.')
-
-    for file in glob.iglob(args.dir + '**/*.org', recursive=True):
-        if OrgBookmark(file).is_an_org_bookmark():
-            os.remove(file)
-
-def read_sync_time():
-    last_sync_time = 0
-    try:
-        with open(os.path.join(stuff_dir,'.diigorg.sync'), 'r') as f:
-            last_sync_time = int(f.readline())
-            print( f'-- LAST SYNC: {time.strftime(ORG_TIMESTAMP_FORMAT, time.localtime(last_sync_time))}')
-    except:
-        print( f'Can\'t find {stuff_dir}.')
-        decision = input('Did you specify the correct directory? [y/n]: ' )
-        match decision:
-            case 'y':pass
-            case 'n':exit()
-    return last_sync_time
-
-def collect_local_bookmarks():
-    logging.info('\n-- Collecting local org bookmarks from ' + args.dir)
 
-    for file in glob.iglob(args.dir + '**/*.org', recursive=True):
-        logline('Local', file, '-- Parsing')
-        local_bookmark_list.append( OrgBookmark(file) )
+    def raw_bookmarks(self):
+        "yield the bookmarks in the checkpoint, reading one tranche at a time"
+        with open(self.path, 'r') as f:
+            f.readline()
+            for record in self.__records(f):
+                yield from record.get('bookmarks', [])
 
-def print_plan():
-    total_changes = 0
-    print(f'\n{len(bookmarks_to_download)} new on diigo.com. Org file will be (over)written:\n------------------------------------')
-    for bm in bookmarks_to_download:
-        total_changes += 1
-        print(f'"{bm.bookmark["title"]}"')
+    def begin(self, start):
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({'started' : int(time.time()), 'page_size' : self.page_size, 'start' : start}) + '\n')
+        self.file.flush()
 
-    print(f'\n{len(bookmarks_to_update_locally)} modified on diigo.com. Org file will be updated (notes will be preserved):\n------------------------------------')
-    for bm in bookmarks_to_update_locally:
-        total_changes += 1
-        print(f'"{bm.bookmark["title"]}"')
+    def resume(self):
+        self.file = open(self.path, 'a')
 
-    print(f'\n{len(bookmarks_to_delete_locally)} missing from diigo.com. Org file will be deleted:\n------------------------------------')
-    for bm in bookmarks_to_delete_locally:
-        total_changes += 1
-        print(f'"{bm.get_node_title()}"')
+    def add(self, start, tranche):
+        self.file.write(json.dumps({'start' : start, 'bookmarks' : tranche}) + '\n')
+        self.file.flush()
 
-    print(f'\n{len(bookmarks_to_upload)} modified org file. Bookmark Will be uploaded to diigo.com:\n------------------------------------')
-    for bm in bookmarks_to_upload:
-        total_changes += 1
-        print(f'"{bm.get_node_title()}"')
-
-    print(f'\n{len(bookmarks_to_delete_remotely)} missing org file. Bookmark will be deleted from diigo.com:\n------------------------------------')
-    for bm in bookmarks_to_delete_remotely:
-        total_changes += 1
-        print(f'"{bm.bookmark["title"]}"')
-
-    return total_changes
+    def complete(self):
+        self.file.write(json.dumps({'complete' : True}) + '\n')
+        self.file.close()
 
+    def clear(self):
+        if self.file:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 def proceed( text = '' ):
     decision = ''
@@ -566,182 +1318,1530 @@ def proceed( text = '' ):
     if decision == 'n':
         exit()
 
-def execute():
-    for bm in bookmarks_to_download:
-        bm.write_bookmark_file()
-
-    for bm in bookmarks_to_update_locally:
-        bm.update_bookmark_file()
-
-    for bm in bookmarks_to_delete_locally:
-        bm.delete_local_bookmark()
-
-    for bm in bookmarks_to_upload:
-        bm.upload_bookmark()
-
-    for bm in bookmarks_to_delete_remotely:
-        bm.delete_remote_bookmark()
-
-def update_sync_time():
-    with open(os.path.join(stuff_dir, '.diigorg.sync'), 'w') as f:
-        f.write(str(int(time.time() + 10)))
-        
-
-last_sync_time = read_sync_time()
-cfg_mod_time = os.path.getmtime( CFG_FILE )
-
-init_line = 'Doing an incremental sync since last update.\nNote that any recent changes on diigo.com to Tags, ReadLater, or Private states will not be detected and require a "--full-sync"\n'
-
-update_all = False
-if cfg_mod_time > last_sync_time:
-    init_line = 'diigorg.cfg has been modified. This pass will update all bookmarks.'
-    update_all = True
-    args.full_sync = True
-
-if args.full_sync:
-    init_line = 'Doing a full sync of all bookmarks.'
-
-# if we're resetting, try to delete all of the existing bookmarks.
-if args.reset:
-    delete_all_local_bookmarks()
-    init_line = "Resetting. Downloading all bookmarks."
-
-print( init_line )
-
-# fetch all diigo bookmarks
-remote_bookmark_list = []
-local_bookmark_list = []
-
-fetch_diigo_bookmarks()
-
-bookmarks_to_upload = []
-bookmarks_to_download = []
-bookmarks_to_update_locally = []
-bookmarks_to_delete_locally = []
-bookmarks_to_delete_remotely = []
-
-if not args.reset:
-
-    collect_local_bookmarks()
+# runs sync operations on two thread pools, one for local file work and one for diigo.com requests,
+# starting each one as soon as it's added. Operations on the same bookmark are chained so they still
+# happen one after another, in the order they were added.
+class SyncScheduler:
+    def __init__(self, local_workers, network_workers):
+        self.pools = {
+            'local' : ThreadPoolExecutor(max_workers=local_workers, thread_name_prefix='local'),
+            'network' : ThreadPoolExecutor(max_workers=network_workers, thread_name_prefix='network')
+        }
+        # short_id -> the operations waiting for the running one on that bookmark to finish
+        self.chains = {}
+        self.remaining = 0
+        self.errors = []
+        self.condition = threading.Condition()
+
+    def add(self, short_id, kind, operation):
+        with self.condition:
+            if self.errors:
+                # no sense in starting anything more
+                raise self.errors[0]
+            self.remaining += 1
+            if short_id in self.chains:
+                self.chains[short_id].append((kind, operation))
+                return
+            self.chains[short_id] = collections.deque()
+        self.__submit(short_id, kind, operation)
+
+    def wait(self):
+        "wait for everything added to finish. Raises the first error, if any"
+        try:
+            with self.condition:
+                # wait in slices so that Ctrl-C still gets through
+                while self.remaining and not self.errors:
+                    self.condition.wait(0.5)
+        finally:
+            self.shutdown()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def shutdown(self):
+        "let the running operations finish, and drop the rest"
+        for pool in self.pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def __submit(self, short_id, kind, operation):
+        try:
+            future = self.pools[kind].submit(operation)
+        except RuntimeError:
+            # the pools are shutting down
+            self.__finished(short_id, None)
+            return
+        future.add_done_callback(lambda future: self.__finished(short_id, future))
+
+    def __finished(self, short_id, future):
+        failed = future is None or future.cancelled()
+        error = None if failed else future.exception()
+        next_step = None
+        with self.condition:
+            if error:
+                self.errors.append(error)
+            chain = self.chains[short_id]
+            if chain and not failed and not error:
+                next_step = chain.popleft()
+            else:
+                # the rest of this bookmark's operations won't happen
+                self.remaining -= len(chain)
+                del self.chains[short_id]
+            self.remaining -= 1
+            self.condition.notify()
+
+        if next_step:
+            self.__submit(short_id, *next_step)
+
+# the part of the library that --since, --until, --folder and --tag limit a sync to. Dates go by the day a bookmark
+# was created, as do the folders made by `subdirs` and the first six characters of every short_id, so those
+# can be told apart without opening anything.
+class SyncScope:
+    DATE_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, root, subdirs, since=None, until=None, folder=None, tag=None):
+        "`since` and `until` are timestamps, and `until` isn't in scope itself"
+        self.root = root
+        self.tag = tag
+        self.folder = os.path.normpath(folder).strip(os.sep) if folder else None
+        self.since = since
+        self.until = until
+
+        # a year folder holds exactly the bookmarks created that year
+        year_folder = bool(self.folder) and re.fullmatch(r'\d{4}', self.folder) and subdirs.split('/')[0] == '%Y'
+        if year_folder:
+            year = int(self.folder)
+            self.since = max(self.since or 0, datetime(year, 1, 1).timestamp())
+            self.until = min(self.until or float('inf'), datetime(year + 1, 1, 1).timestamp())
+        # whether short_ids alone tell what's in scope
+        self.by_date = not self.tag and (not self.folder or year_folder)
+
+        if self.folder:
+            self.roots = [os.path.join(root, self.folder, '')]
+        elif (self.since or self.until) and subdirs.split('/')[0] == '%Y':
+            first = datetime.fromtimestamp(self.since).year if self.since else 0
+            last = datetime.fromtimestamp(self.until - 1).year if self.until else 9999
+            self.roots = [os.path.join(root, entry, '') for entry in sorted(os.listdir(root))
+                          if re.fullmatch(r'\d{4}', entry) and first <= int(entry) <= last]
+        else:
+            self.roots = [root]
+
+    @classmethod
+    def day(cls, text, option, next_day=False):
+        "the timestamp of the start of a day given as YYYY-MM-DD, or of the day after it"
+        if not text:
+            return None
+        try:
+            day = datetime.strptime(text, cls.DATE_FORMAT)
+        except ValueError:
+            raise SyncError(f'{option} {text} isn\'t a date like 2021-12-31.')
+        return (day + timedelta(days=1) if next_day else day).timestamp()
+
+    def __bool__(self):
+        return bool(self.since or self.until or self.folder or self.tag)
+
+    def __str__(self):
+        parts = []
+        if self.since:
+            parts.append(f'created from {datetime.fromtimestamp(self.since).strftime(self.DATE_FORMAT)}')
+        if self.until:
+            parts.append(f'created before {datetime.fromtimestamp(self.until).strftime(self.DATE_FORMAT)}')
+        if self.folder:
+            parts.append(f'in {self.folder}')
+        if self.tag:
+            parts.append(f'tagged {self.tag}')
+        return ', '.join(parts)
+
+    def covers_created(self, timestamp):
+        return (self.since is None or timestamp >= self.since) and (self.until is None or timestamp < self.until)
+
+    def covers_short_id(self, short_id):
+        "whether a bookmark's creation day is in scope. Only the whole story if by_date"
+        try:
+            return self.covers_created(datetime.strptime(short_id[:6], '%y%m%d').timestamp())
+        except ValueError:
+            return False
+
+    def covers(self, rbm):
+        return not self or (self.covers_created(rbm.created_timestamp)
+                            and (not self.folder or rbm.folder == self.folder or rbm.folder.startswith(self.folder + '/'))
+                            and (not self.tag or self.tag in rbm.bookmark['tags']))
+
+    def covers_file(self, path):
+        "whether an org file is in scope, by where it is and what it's called. Tags need the file read, see covers_tags()"
+        if not self:
+            return True
+        if not any(path.startswith(root) for root in self.roots):
+            return False
+        return not (self.since or self.until) or self.covers_short_id(short_id_from_filename(path))
+
+    def covers_tags(self, tags):
+        "whether the tags of an org file, as org has them, are in scope"
+        return not self.tag or org_tag(self.tag) in (tags or ())
+
+# a write-ahead journal of the planned operations and of the ones that have finished,
+# so that a sync that dies partway through execute() can be finished by the next run.
+class SyncJournal:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def pending(self):
+        """
+        returns (planned_at, whether the plan was complete, operations that never finished) from an interrupted sync.
+        A plan that's executed while it's being made is left incomplete if the sync is interrupted before it's done.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0, False, []
+
+        planned_at, complete, plan, done = 0, False, [], set()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may have been cut off
+                break
+            if 'plan' in record:
+                planned_at, plan = record['planned_at'], record['plan']
+            elif 'planned' in record:
+                plan.append(record['planned'])
+            elif 'done' in record:
+                done.add(record['done'])
+            elif 'plan_complete' in record:
+                complete = True
+
+        return planned_at, complete, [operation for index, operation in enumerate(plan) if index not in done]
+
+    def __begin(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            # to the fraction of a second, like the cfg file's mtime it's compared to
+            f.write(json.dumps({'planned_at' : time.time(), 'plan' : []}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a')
+        self.count = 0
+
+    def add(self, operation):
+        "record an operation before it starts. Returns its index, for complete()"
+        with self.lock:
+            if not self.file:
+                self.__begin()
+            self.file.write(json.dumps({'planned' : operation}) + '\n')
+            self.file.flush()
+            self.count += 1
+            return self.count - 1
+
+    def complete(self, index):
+        with self.lock:
+            self.file.write(json.dumps({'done' : index}) + '\n')
+            self.file.flush()
+
+    def plan_complete(self):
+        "record that every operation of the plan has been added"
+        with self.lock:
+            if self.file:
+                self.file.write(json.dumps({'plan_complete' : True}) + '\n')
+                self.file.flush()
+
+    def finish(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# everything needed to sync one bookmarks directory. diigorg.py makes one per run, and --daemon keeps
+# the same one around between syncs, so that its diigo.com session and local caches stay warm.
+#
+#   syncer = Syncer('/path/to/bookmarks', yes=True)
+#   syncer.plan()
+#   syncer.execute()
+#
+# Options are the same as the command line's, e.g. full_sync=True or safe=True.
+class Syncer:
+    # parse_local_bookmarks() leaves fewer files than this to the planner
+    PARSE_IN_PROCESSES_MIN = 500
+    PARSE_CHUNK_SIZE = 200
+
+    def __init__(self, directory, interactive=True, **options):
+        self.options = argParser.parse_args([])
+        unknown = set(options) - set(vars(self.options))
+        if unknown:
+            raise TypeError(f'unknown options: {", ".join(sorted(unknown))}')
+        vars(self.options).update(options)
+
+        if not os.path.isdir(directory):
+            raise SyncError(f'{directory} is not a valid path')
+        # the manifest goes by path, so the same directory has to come out the same however it's given
+        self.dir = os.path.join(os.path.realpath(directory), '')
+        self.options.dir = self.dir
+        self.interactive = interactive
+
+        if self.options.reset:
+            self.options.full_sync = True
+            self.options.safe = True
+        elif self.options.force_update_all_local:
+            self.options.full_sync = True
+            self.options.safe = True
+
+        if self.options.fix_tags_on_server:
+            self.options.full_sync = True
+
+        if self.options.reset and (self.options.since or self.options.until or self.options.folder or self.options.tag):
+            raise SyncError('--reset deletes every org file, so it can\'t be combined with --since, --until, --folder or --tag.')
+
+        self.cfg_file = os.path.join(self.dir, 'diigorg.cfg')
+        self.stuff_dir = os.path.join(self.dir, '.diigorg')
+        os.makedirs(self.stuff_dir, exist_ok=True)
+        self.sync_lock = SyncLock(os.path.join(self.stuff_dir, 'lock'))
+
+        if self.options.test:
+            self.fetch_start = 0
+            self.fetch_stop_at = 30
+            self.fetch_count_per_tranche = 20
+            self.fetch_sort = 1
+        else:
+            self.fetch_start = 0
+            self.fetch_stop_at = -1
+            self.fetch_count_per_tranche = 100
+            self.fetch_sort = 1
+
+        self.metrics = SyncMetrics()
+        self.load_config()
+        self.local_files = LocalFileIndex(self.dir)
+        self.remote_snapshot = RemoteSnapshot(os.path.join(self.stuff_dir, 'remote.snapshot'))
+        self.library = RemoteLibrary(os.path.join(self.stuff_dir, 'library.sqlite'))
+        self.journal = SyncJournal(os.path.join(self.stuff_dir, 'journal'))
+        self.fetch_checkpoint = FetchCheckpoint(os.path.join(self.stuff_dir, 'fetch.checkpoint'), self.fetch_count_per_tranche)
+        self.counter_lock = threading.Lock()
+        self.last_sync_time = 0
+        # while execute() is running operations, which plan_stream() may be feeding it
+        self.executing = False
+        self.__start_run()
+
+    def load_config(self):
+        "(re)read diigorg.cfg, and set up everything that depends on it"
+        cfg = configparser.ConfigParser()
+        if not cfg.read(self.cfg_file):
+            raise SyncError(f'Can\'t read {self.cfg_file}.')
+
+        if not cfg.getboolean("file_properties","tags",fallback=False) and not cfg.getboolean("heading_properties", "tags", fallback=False):
+            raise SyncError( "diigorg.cfg error: Both file_properties:tags and heading_properties:tags are set off. One of them needs to be on." )
+
+        self.cfg = cfg
+        self.cfg_mod_time = os.path.getmtime(self.cfg_file)
+        self.diigo = DiigoClient(cfg["diigo_credentials"]["username"], cfg["diigo_credentials"]['passwd'], cfg["diigo_credentials"]["api_key"],
+                                 retries = cfg.getint('network', 'retries', fallback=5),
+                                 backoff = cfg.getfloat('network', 'retry_backoff', fallback=1.0),
+                                 requests_per_second = cfg.getfloat('network', 'requests_per_second', fallback=5),
+                                 pool_size = max(10, cfg.getint('network', 'fetch_concurrency', fallback=4), cfg.getint('network', 'network_workers', fallback=4)),
+                                 api_url = cfg.get('network', 'api_url', fallback=DiigoClient.API_URL),
+                                 metrics = self.metrics)
+        self.manifest = LocalManifest(os.path.join(self.stuff_dir, 'manifest.sqlite'), cfg["options"]["todo_keyword"])
+        self.renderer = BookmarkRenderer(cfg)
+
+    def __start_run(self):
+        "forget the last run's plan and counts"
+        if os.path.exists(self.cfg_file) and os.path.getmtime(self.cfg_file) != self.cfg_mod_time:
+            self.load_config()
+
+        # a run may turn on full_sync for itself, without that sticking to the next one
+        self.args = argparse.Namespace(**vars(self.options))
+        self.scope = SyncScope(self.dir, self.cfg["options"]["subdirs"], SyncScope.day(self.args.since, '--since'),
+                               SyncScope.day(self.args.until, '--until', next_day=True), self.args.folder, self.args.tag)
+        self.metrics.reset()
+        self.num_dl = 0
+        self.num_ul = 0
+        self.num_del = 0
+        self.num_unchanged = 0
+        self.update_all = False
+        self.resumed = False
+        # whether the interrupted sync had finished planning, or only got part of the way
+        self.resumed_plan_complete = True
+        # rewriting from the library, without a word to diigo.com
+        self.offline = False
+
+        # short_id -> content hash of every diigo.com bookmark fetched, for the remote snapshot
+        self.fetched_hashes = {}
+        # short_id -> url of the same, to tell a bookmark that turns up twice from two that share an id
+        self.fetched_urls = {}
+        self.remote_duplicates = set()
+        # the creation days the rolling sweep covered, once it has, and the bookmarks it fetched
+        self.sweep_window = None
+        self.swept_ids = set()
+        self.local_bookmark_list = []
+
+        self.bookmarks_to_upload = []
+        self.bookmarks_to_download = []
+        self.bookmarks_to_update_locally = []
+        self.bookmarks_to_delete_locally = []
+        self.bookmarks_to_delete_remotely = []
+        self.bookmarks_to_regenerate = []
+        self.unsettled_ids = set()
+        # org files that are gone, for the manifest to drop once the plan is carried out
+        self.files_to_forget = []
+
+    def tally(self, counter):
+        with self.counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def sync(self, changed_paths=None):
+        "plan, confirm and execute one sync, like a run of diigorg.py"
+        with self.sync_lock:
+            self.__sync(changed_paths)
+
+    def __sync(self, changed_paths):
+        try:
+            if self.args.yes or not self.interactive:
+                # there's nothing to confirm, so each operation can start as soon as it's planned,
+                # while the rest of the bookmarks are still being fetched
+                self.execute(self.plan_stream(changed_paths))
+                self.print_plan()
+            else:
+                total_changes = self.plan(changed_paths)
+                self.print_plan()
+
+                if total_changes > 0:
+                    proceed()
+
+                self.execute()
+        finally:
+            self.write_metrics()
+
+        print('Done!')
+        print(f'Downloaded \t{self.num_dl} bookmarks.')
+        print(f'Uploaded \t{self.num_ul} bookmarks.')
+        print(f'Deleted \t{self.num_del} bookmarks.')
+        if self.num_unchanged:
+            print(f'Unchanged \t{self.num_unchanged} bookmarks were already up to date and were not rewritten.')
+
+        if self.resumed and not self.resumed_plan_complete:
+            # what it never got to plan is still waiting, from the same last sync time
+            print( 'The interrupted sync was stopped before it had planned everything, so carrying on with a new sync.' )
+            self.__sync(None)
+
+    def write_metrics(self):
+        "write what the metrics saw during the last sync to --metrics, or .diigorg/metrics.json"
+        path = self.args.metrics or os.path.join(self.stuff_dir, 'metrics.json')
+        try:
+            self.metrics.write(path, **{'bookmarks:downloaded' : self.num_dl, 'bookmarks:uploaded' : self.num_ul,
+                                        'bookmarks:deleted' : self.num_del, 'bookmarks:unchanged' : self.num_unchanged})
+        except OSError as e:
+            logging.warning(f'Couldn\'t write the metrics to {path}: {e}')
+
+    def plan(self, changed_paths=None):
+        """
+        Work out what has to change on each side and fill in the bookmarks_to_* lists. Returns the number of changes.
+        If the last sync was interrupted, the plan is what it left undone instead.
+        `changed_paths`, if given, are the only org files that were added, changed or removed since the last sync,
+        and an incremental sync only looks at those rather than at the whole tree.
+        """
+        for operation in self.plan_stream(changed_paths):
+            pass
+        # the first bookmark with an id was planned before the second one turned up
+        for name, (kind, method, bm_list) in self.planned_operations().items():
+            bm_list[:] = [bm for bm in bm_list if bm.short_id not in self.remote_duplicates]
+        return self.__count_planned()
+
+    def plan_stream(self, changed_paths=None):
+        """
+        plan() as a generator of (operation name, bookmark) pairs, each one yielded as soon as it's decided.
+        diigo.com bookmarks are compared as their tranches arrive, and only the ones with something to do are kept.
+        """
+        self.__start_run()
+        args = self.args
+        started = time.perf_counter()
+        self.last_sync_time = self.read_sync_time()
+
+        if self.resume_interrupted_sync():
+            self.resumed = True
+            self.offline = bool(self.bookmarks_to_regenerate)
+            for name, (kind, method, bm_list) in self.planned_operations().items():
+                for bm in bm_list:
+                    yield name, bm
+            return
 
-    logging.info('\n-- Evaluating local org bookmarks')
+        init_line = 'Doing an incremental sync since last update.\nNote that any recent changes on diigo.com to Tags, ReadLater, or Private states will not be detected and require a "--full-sync"\n'
 
-    for lbm in local_bookmark_list:
-        lbm.match = find_matching_bookmark(remote_bookmark_list, lbm)
-        lbm.is_matched = lbm.match != None
+        # with the whole library kept in .diigorg, rewriting every file doesn't need diigo.com
+        if args.regenerate or (args.force_update_all_local and not args.reset and self.library.complete):
+            self.offline = True
+            args.full_sync = False
+        elif self.cfg_mod_time > self.last_sync_time:
+            self.update_all = True
+            if self.library.complete and not args.full_sync:
+                init_line = 'diigorg.cfg has been modified. This pass will update all bookmarks from the copies kept in .diigorg, and only fetch what changed since the last sync.'
+            else:
+                init_line = 'diigorg.cfg has been modified. This pass will update all bookmarks.'
+                args.full_sync = True
+
+        if args.full_sync:
+            init_line = 'Doing a full sync of all bookmarks.'
+
+        if self.offline:
+            if not self.library.complete:
+                raise SyncError('There are no copies of the bookmarks in .diigorg to regenerate from yet. Do a --full-sync first.')
+            init_line = 'Rewriting all bookmarks from the copies kept in .diigorg, without contacting diigo.com.'
+
+        # if we're resetting, try to delete all of the existing bookmarks.
+        if args.reset:
+            self.delete_all_local_bookmarks()
+            init_line = "Resetting. Downloading all bookmarks."
+
+        print( init_line )
+        if self.scope:
+            print( f'Only syncing the bookmarks {self.scope}.' )
+        if pages := self.sweep_pages():
+            print( f'Also checking {pages} pages of older bookmarks for changes only a full sync would find.' )
+
+        # the local side comes first, so that each diigo.com bookmark can be matched the moment it arrives
+        removed = []
+        if not args.reset:
+            with self.metrics.timer('collect'):
+                if changed_paths is None or args.full_sync or self.update_all or self.offline:
+                    removed = self.collect_local_bookmarks()
+                else:
+                    removed = self.collect_changed_local_bookmarks(changed_paths)
+            if args.full_sync:
+                # a full sync is likely to compare most of them
+                self.parse_local_bookmarks()
+        local_bookmark_index, local_duplicates = index_bookmarks(self.local_bookmark_list, 'local')
+
+        if self.offline:
+            # files that are gone stay in the manifest, for the next sync to act on
+            for rbm in self.__kept_bookmarks(local_bookmark_index, local_duplicates, rewrite_changed=args.force_update_all_local):
+                yield self.__add_to_plan('regenerate', rbm)
+            self.metrics.observe('plan', time.perf_counter() - started)
+            return
 
+        logging.info('\n-- Comparing downloaded Diigo bookmarks as they arrive')
+
+        # deletions on diigo.com wait until everything is fetched, in case another bookmark turns out to share the id
+        remote_deletions = []
+        for rbm in self.fetch_diigo_bookmarks():
+            if rbm.short_id in local_duplicates:
+                logline('Server', rbm, '', 'DUPLICATE ID. Skipping.')
+                continue
+
+            lbm = local_bookmark_index.get(rbm.short_id)
+            if lbm is None and (changed_paths is not None and not args.full_sync or self.scope):
+                # only the changed org files, or the ones in scope, were collected, so look for the one this belongs to
+                file = self.local_files.find(rbm.short_id)
+                if file and os.path.exists(file):
+                    lbm = OrgBookmark(self, file)
+                    self.local_bookmark_list.append(lbm)
+                    local_bookmark_index[lbm.short_id] = lbm
+
+            rbm.match = lbm
+            rbm.is_matched = lbm != None
+            if lbm:
+                lbm.match = rbm
+                lbm.is_matched = True
+                if planned := self.__plan_local(lbm):
+                    yield self.__add_to_plan(*planned)
+
+            if not args.force_update_all_local:
+                if planned := self.__plan_remote(rbm):
+                    if planned[0] == 'delete_remote':
+                        remote_deletions.append(rbm)
+                    else:
+                        yield self.__add_to_plan(*planned)
+
+            # the plan holds on to what has something to do, and the rest can go, annotations and all
+            rbm.match = None
+            if lbm:
+                lbm.match = None
+
+        for rbm in remote_deletions:
+            if rbm.short_id not in self.remote_duplicates:
+                yield self.__add_to_plan('delete_remote', rbm)
+
+        if self.sweep_window is not None and changed_paths is not None:
+            # only the changed org files were collected, so bring in the rest of the ones the sweep covered
+            for file in self.local_files.files():
+                short_id = short_id_from_filename(file)
+                if short_id not in local_bookmark_index and self.sweep_window.covers_short_id(short_id) and os.path.exists(file):
+                    lbm = OrgBookmark(self, file)
+                    self.local_bookmark_list.append(lbm)
+                    local_bookmark_index[lbm.short_id] = lbm
+
+        logging.info('\n-- Evaluating unmatched local org bookmarks')
+
+        for lbm in self.local_bookmark_list:
+            if lbm.short_id in local_duplicates or lbm.short_id in self.remote_duplicates:
+                logline('Local', lbm, '', 'DUPLICATE ID. Skipping.')
+            elif not lbm.is_matched:
+                if planned := self.__plan_local(lbm):
+                    yield self.__add_to_plan(*planned)
+
+        if self.update_all and not args.full_sync:
+            # an incremental sync only fetched what changed, so the rest comes from the library
+            for rbm in self.__kept_bookmarks(local_bookmark_index, local_duplicates):
+                yield self.__add_to_plan('update', rbm)
+
+        for bm in self.__removed_bookmarks(removed):
+            yield self.__add_to_plan('delete_remote', bm)
+
+        if not self.executing:
+            # otherwise execute() saves it once its workers are done with it
+            self.manifest.save()
+        # from start to finish, so with --yes it overlaps the fetch and execute
+        self.metrics.observe('plan', time.perf_counter() - started)
+
+    def __kept_bookmarks(self, local_bookmark_index, local_duplicates, rewrite_changed=False):
+        """
+        DiigoBookmarks from the library for the org files that exist and that this sync didn't fetch, matched to them.
+        Files edited since the last sync are left alone unless `rewrite_changed`.
+        """
+        logging.info('\n-- Reading the bookmarks kept in .diigorg')
+        for raw in self.library.raw_bookmarks():
+            rbm = DiigoBookmark(self, raw)
+            lbm = local_bookmark_index.get(rbm.short_id)
+            if lbm is None or rbm.short_id in self.fetched_hashes or rbm.short_id in local_duplicates or not self.scope.covers(rbm):
+                continue
+            if lbm.has_changed and not rewrite_changed:
+                logline('Local', lbm, lbm.modified_timestamp, 'has changed since the last sync. Not rewriting it.')
+                continue
+            rbm.match = lbm
+            rbm.is_matched = True
+            lbm.match = rbm
+            lbm.is_matched = True
+            yield rbm
+
+    def __add_to_plan(self, name, bm):
+        self.planned_operations()[name][2].append(bm)
+        return name, bm
+
+    def __count_planned(self):
+        return sum(len(bm_list) for kind, method, bm_list in self.planned_operations().values())
+
+    def __plan_local(self, lbm):
+        "what to do about a local bookmark, once its diigo.com match is known. Returns (operation name, bookmark) or None"
+        args = self.args
         action=''
+        # the rolling sweep knows as much about what it fetched as a full sync does
+        full_sync = args.full_sync or self.swept(lbm)
 
         # force update all local bmarks
-        if args.force_update_all_local:
+        if args.force_update_all_local and lbm.is_matched:
             action = 'update'
 
-        elif args.full_sync and lbm.is_matched and lbm.compare_to_match_minor():
+        elif full_sync and lbm.is_matched and self.needs_minor_comparison(lbm) and lbm.compare_to_match_minor():
             # if we're doing a full sync, compare every bookmark
             # This is a resolve because we have no idea whether this was changed on the server
-            logline('Local', lbm.logging_title, 'full sync and tags or readlater are different')
+            logline('Local', lbm, 'full sync and tags or readlater are different')
             action = 'resolve'
 
-        elif args.full_sync and not lbm.has_changed and not lbm.is_matched:
+        elif full_sync and not lbm.has_changed and not lbm.is_matched and not self.scope.tag and lbm.is_an_org_bookmark():
             # in the case that we downloaded all remote bookmarks, we can determine whether
-            # the absence of a bookmark on diigo means we should delete it locally
-            logline('Local', lbm.logging_title, org_timestamp(lbm.modified_timestamp), ' hasn\'t changed and we know it does not exist on server. Delete.')
+            # the absence of a bookmark on diigo means we should delete it locally.
+            # Not with --tag, since the tag may only have been taken off it on diigo.com,
+            # and not if the org file isn't a bookmark at all
+            logline('Local', lbm, lbm.modified_timestamp, ' hasn\'t changed and we know it does not exist on server. Delete.')
             action = 'delete'
 
         elif not lbm.has_changed and lbm.is_matched:
-            logline('Local', lbm.logging_title, 'hasn\'t changed and remote match exists.')
+            logline('Local', lbm, 'hasn\'t changed and remote match exists.')
 
-        elif args.full_sync and not lbm.has_changed:
-            logline('Local', lbm.logging_title, 'hasn\'t changed and we don\'t know whether remote exists')
+        elif full_sync and not lbm.has_changed:
+            logline('Local', lbm, 'hasn\'t changed and we don\'t know whether remote exists')
 
         elif lbm.has_changed:
             if lbm.is_matched and lbm.match.has_changed and lbm.compare_to_match():
                 action = 'resolve'
             else:
-                logline('Local', lbm.logging_title, org_timestamp(lbm.modified_timestamp), ' has changed and there\'s no conflict. Upload.')
+                logline('Local', lbm, lbm.modified_timestamp, ' has changed and there\'s no conflict. Upload.')
                 action = 'upload'
 
         if action == 'resolve':
-            decision = ''
-            all_diffs = lbm.compare_to_match() + lbm.compare_to_match_minor()
-
-            if args.fix_tags_on_server:
-                if len(all_diffs) == 1 and all_diffs[0][0] == 'tags':
-                    print(f'{lbm.logging_title} : {all_diffs[0][2]} --> {all_diffs[0][1]}')
-                    action = 'upload'
-            else:
-                print('THERE\'S A CONFLICT:')
-                print(f'{lbm.logging_title} needs to be resolved.')
-                print('\n')
-                print(f'{"Field".ljust(40)} {"Local".ljust(40)} {"Server".ljust(40)}')
-                for item in all_diffs:
-                    print(f'{str(item[0]).ljust(40)} {str(item[1]).ljust(40)} {str(item[2]).ljust(40)}')
-                print('\n')
-
-                while decision not in ['l','s']:
-                    decision = input('[l] Keep Local version. [s] Keep Server version. [q] Quit :').lower()
-
-                match decision:
-                    case 'l':
-                        action = 'upload'
-                    case 's':
-                        action = 'update'
-                    case 'q':
-                        exit()
+            action = self.resolve_conflict(lbm)
 
         match action:
             case 'upload':
-                bookmarks_to_upload.append(lbm)
+                return 'upload', lbm
             case 'delete':
-                bookmarks_to_delete_locally.append(lbm)
+                return 'delete_local', lbm
             case 'update':
-                bookmarks_to_update_locally.append(lbm.match)
+                return 'update', lbm.match
+
+    def resolve_conflict(self, lbm):
+        "decide between the local and diigo.com versions of a bookmark. Returns 'upload', 'update' or ''"
+        all_diffs = lbm.compare_to_match() + lbm.compare_to_match_minor()
+
+        if self.args.fix_tags_on_server:
+            if len(all_diffs) == 1 and all_diffs[0][0] == 'tags':
+                print(f'{lbm.logging_title} : {all_diffs[0][2]} --> {all_diffs[0][1]}')
+                return 'upload'
+            # still different after this sync, so make sure the next full sync looks at it again
+            self.unsettled_ids.add(lbm.short_id)
+            return ''
 
-logging.info('\n-- Comparing to downloaded Diigo bookmarks')
+        if not self.interactive:
+            print(f'THERE\'S A CONFLICT: {lbm.logging_title} differs in {", ".join(str(item[0]) for item in all_diffs)}. Leaving it alone.')
+            logging.warning(f'conflict left unresolved: {lbm.file}')
+            self.unsettled_ids.add(lbm.short_id)
+            return ''
+
+        print('THERE\'S A CONFLICT:')
+        print(f'{lbm.logging_title} needs to be resolved.')
+        print('\n')
+        print(f'{"Field".ljust(40)} {"Local".ljust(40)} {"Server".ljust(40)}')
+        for item in all_diffs:
+            print(f'{str(item[0]).ljust(40)} {str(item[1]).ljust(40)} {str(item[2]).ljust(40)}')
+        print('\n')
 
-if not args.force_update_all_local:
-    for rbm in remote_bookmark_list:
-        rbm.match = find_matching_bookmark(local_bookmark_list, rbm)
-        rbm.is_matched = rbm.match != None
+        decision = ''
+        while decision not in ['l','s','q']:
+            decision = input('[l] Keep Local version. [s] Keep Server version. [q] Quit :').lower()
 
+        match decision:
+            case 'l':
+                return 'upload'
+            case 's':
+                return 'update'
+            case 'q':
+                exit()
+
+    def __plan_remote(self, rbm):
+        "what to do about a diigo.com bookmark, once its local match is known. Returns (operation name, bookmark) or None"
         # old bookmark. Move on.
         action = ''
         if not rbm.has_changed and rbm.is_matched:
-            logline('Server', rbm.logging_title, org_timestamp(rbm.modified_timestamp), '- has not changed')
-            if update_all:
+            logline('Server', rbm, rbm.modified_timestamp, '- has not changed')
+            if self.update_all:
                 action = 'update'
 
-        elif rbm.is_new or args.reset:
-            logline('Server', rbm.logging_title, org_timestamp(rbm.modified_timestamp), f'NEW. Writing to {rbm.file}')
+        elif rbm.is_new or self.args.reset:
+            logline('Server', rbm, rbm.modified_timestamp, lambda: f'NEW. Writing to {rbm.file}')
+            action = 'download'
+
+        elif rbm.has_changed and not rbm.is_matched:
+            # changed on diigo.com after its org file was deleted. Keep the server's version.
+            logline('Server', rbm, rbm.modified_timestamp, lambda: f'CHANGED, but its org file is gone. Writing to {rbm.file}')
             action = 'download'
 
         elif rbm.has_changed:
-            logline('Server', rbm.logging_title, org_timestamp(rbm.modified_timestamp), f'CHANGED. Mark for updating {rbm.match.logging_title}.')
+            logline('Server', rbm, rbm.modified_timestamp, lambda: f'CHANGED. Mark for updating {rbm.match.logging_title}.')
             action = 'update'
 
         elif not rbm.is_new and not rbm.is_matched:
-            logline('Server', rbm.logging_title, org_timestamp(rbm.modified_timestamp), f'DELETED. Mark for deletion.')
+            logline('Server', rbm, rbm.modified_timestamp, 'DELETED. Mark for deletion.')
             action = 'delete'
 
         match action:
             case 'download':
-                bookmarks_to_download.append(rbm)
+                return 'download', rbm
             case 'update':
-                bookmarks_to_update_locally.append(rbm)
+                return 'update', rbm
             case 'delete':
-                bookmarks_to_delete_remotely.append(rbm)
+                return 'delete_remote', rbm
+
+    def swept(self, lbm):
+        "whether the rolling sweep fetched `lbm`'s bookmark, or would have if it were still on diigo.com"
+        if lbm.is_matched:
+            return lbm.match.short_id in self.swept_ids
+        return self.sweep_window is not None and self.sweep_window.covers_short_id(lbm.short_id)
+
+    def needs_minor_comparison(self, lbm):
+        "whether a full sync has to compare tags, readlater and privacy of a matched local bookmark"
+        return lbm.has_changed or self.args.fix_tags_on_server or not self.remote_snapshot.is_unchanged(lbm.match)
 
+    def fetch_tranche(self, start, count=None, sort=None):
+        if self.fetch_stop_at >= 0 and start >= self.fetch_stop_at:
+            return ''
+
+        params = {'filter' : 'all', 'count' : count or self.fetch_count_per_tranche, 'start' : start, 'sort' : self.fetch_sort if sort is None else sort}
+        if self.scope.tag:
+            params['tags'] = self.scope.tag
+        with self.metrics.timer('fetch_tranche'):
+            response = self.diigo.get(params)
+
+        if response.status_code != 200:
+            response.close()
+            raise SyncError( f'Error retrieving bookmarks from diigo.com\n{response.text}' )
+        # spinner
+        sys.stdout.write( next( spinner ) )
+        sys.stdout.flush()
+        sys.stdout.write('\b')
+
+        response.close()
+        return response.json()
+
+    def fetch_tranches_concurrently(self, start, workers, sort=None):
+        "yield (start, tranche) in order while keeping `workers` requests in flight. Stops at the first short or empty tranche."
+        pool = ThreadPoolExecutor(max_workers=workers)
+        pending = collections.deque()
+        try:
+            while True:
+                while len(pending) < workers:
+                    pending.append((start, pool.submit(self.fetch_tranche, start, None, sort)))
+                    start += self.fetch_count_per_tranche
+
+                tranche_start, future = pending.popleft()
+                tranche = future.result()
+                if tranche:
+                    yield tranche_start, tranche
+                if len(tranche) < self.fetch_count_per_tranche:
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def fetch_changed_since(self, timestamp):
+        "yield bookmarks, most recently updated first, until reaching one that hasn't been updated since `timestamp`"
+        start = self.fetch_start
+        while bookmarks_tranche := self.fetch_tranche(start=start):
+            for b in bookmarks_tranche:
+                entry = self.__received(b)
+                if entry.modified_timestamp <= timestamp:
+                    return
+                yield entry
+            start += self.fetch_count_per_tranche
+
+    def fetch_created_between(self, since, until):
+        "yield the bookmarks created from `since` until before `until`, newest first, and maybe some either side of them"
+        start = self.fetch_start
+        if until is not None:
+            # bookmarks added in the meantime push the rest down the list, so start a tranche early
+            start = max(start, self.__first_created_before(until) - self.fetch_count_per_tranche)
+
+        for tranche_start, bookmarks_tranche in self.fetch_tranches_concurrently(start, self.cfg.getint('network', 'fetch_concurrency', fallback=4), sort=0):
+            for b in bookmarks_tranche:
+                yield self.__received(b)
+            if since is not None and parse_diigo_timestamp(bookmarks_tranche[-1]['created_at']) < since:
+                return
+
+    def __first_created_before(self, timestamp):
+        "where the first bookmark created before `timestamp` is in the list, newest first. Bisects it one bookmark at a time."
+        def created_at(start):
+            tranche = self.fetch_tranche(start, count=1, sort=0)
+            return parse_diigo_timestamp(tranche[0]['created_at']) if tranche else None
+
+        # created_at(low) is at or after timestamp, and created_at(high) is before it or past the end
+        low, high = 0, 1
+        if (created := created_at(low)) is None or created < timestamp:
+            return 0
+        while (created := created_at(high)) is not None and created >= timestamp:
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if (created := created_at(middle)) is not None and created >= timestamp:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def fetch_diigo_bookmarks(self):
+        "yield the diigo.com bookmarks this sync has to look at, each one once, as their tranches arrive"
+        sys.stdout.write('\nFetching bookmarks...')
+
+        for entry in self.__fetch():
+            if not self.scope.covers(entry):
+                continue
+            # a bookmark can turn up twice when the list shifts between tranches
+            url = self.fetched_urls.get(entry.short_id)
+            if url is None:
+                self.fetched_urls[entry.short_id] = entry.bookmark['url']
+                self.fetched_hashes[entry.short_id] = entry.content_hash
+                yield entry
+            elif url != entry.bookmark['url'] and entry.short_id not in self.remote_duplicates:
+                # a different bookmark with the same id, which neither of them can be synced under
+                self.remote_duplicates.add(entry.short_id)
+                print( f'WARNING: more than one diigo.com bookmark has the id {entry.short_id}. They will be left alone until that is fixed.' )
+                logging.warning(f'duplicate diigo.com short_id {entry.short_id}')
+
+        sys.stdout.write('\n')
+
+    def __fetch(self):
+        if self.args.full_sync and (self.scope.since or self.scope.until):
+            yield from self.fetch_created_between(self.scope.since, self.scope.until)
+        elif self.args.full_sync and self.scope:
+            # only a fetch of the whole library keeps a checkpoint
+            for tranche_start, bookmarks_tranche in self.fetch_tranches_concurrently(self.fetch_start, self.cfg.getint('network', 'fetch_concurrency', fallback=4)):
+                for b in bookmarks_tranche:
+                    yield self.__received(b)
+        elif self.args.full_sync:
+            start = self.fetch_start
+            if resumed := self.fetch_checkpoint.load():
+                started, start = resumed
+                sys.stdout.write(f'\nCarrying on from an interrupted fetch...')
+                # anything updated since the checkpoint began has moved to the front of the list, so get those first.
+                # Then back up one tranche in case deletions shifted bookmarks down past the old position.
+                yield from self.fetch_changed_since(started - 60)
+                for b in self.fetch_checkpoint.raw_bookmarks():
+                    yield self.__received(b)
+                start = max(self.fetch_start, start - self.fetch_count_per_tranche)
+                self.fetch_checkpoint.resume()
+            else:
+                self.fetch_checkpoint.begin(start)
+
+            # we need everything, so there's no reason to wait for one tranche before asking for the next
+            for tranche_start, bookmarks_tranche in self.fetch_tranches_concurrently(start, self.cfg.getint('network', 'fetch_concurrency', fallback=4)):
+                self.fetch_checkpoint.add(tranche_start, bookmarks_tranche)
+                for b in bookmarks_tranche:
+                    yield self.__received(b)
+            self.fetch_checkpoint.complete()
+        else:
+            yield from self.fetch_changed_since(self.last_sync_time)
+            if pages := self.sweep_pages():
+                yield from self.sweep(pages)
+
+    def sweep_pages(self):
+        "how many pages the rolling sweep takes this run. Only incremental syncs of everything sweep"
+        if self.args.full_sync or self.scope or self.offline or self.resumed or self.args.test:
+            return 0
+        return self.args.sweep if self.args.sweep is not None else self.cfg.getint('network', 'sweep_pages', fallback=0)
+
+    def sweep(self, pages):
+        """
+        yield the next window of the rolling sweep: `pages` pages of the bookmarks created before the cursor, newest first,
+        and then the rest of the day the last of them was created, so that the window is whole days, as short_ids go.
+        Then sweep_window is the days it covered.
+        """
+        cursor = self.read_sweep_cursor()
+        low = None
+        count = 0
+        for rbm in self.fetch_created_between(None, cursor):
+            if cursor is not None and rbm.created_timestamp >= cursor:
+                continue
+            if low is not None and rbm.created_timestamp < low:
+                break
+            self.swept_ids.add(rbm.short_id)
+            self.metrics.add('sweep_bookmarks')
+            yield rbm
+            count += 1
+            if low is None and count >= pages * self.fetch_count_per_tranche:
+                low = datetime.fromtimestamp(rbm.created_timestamp).replace(hour=0, minute=0, second=0).timestamp()
+        else:
+            # that was the oldest bookmark, so the next sweep starts over from the newest
+            low = None
+        self.sweep_window = SyncScope(self.dir, self.cfg["options"]["subdirs"], since=low, until=cursor)
+        logging.info(f'\n-- Swept {count} bookmarks created {self.sweep_window or "at any time"}')
+
+    def read_sweep_cursor(self):
+        "the rolling sweep carries on with the bookmarks created before this, or from the newest if it's None"
+        try:
+            with open(os.path.join(self.stuff_dir, 'sweep.cursor'), 'r') as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_sweep_cursor(self, cursor):
+        with open(os.path.join(self.stuff_dir, 'sweep.cursor'), 'w') as f:
+            f.write('' if cursor is None else str(int(cursor)))
+
+    def __received(self, raw):
+        "a DiigoBookmark for a bookmark diigo.com sent, which the library keeps too"
+        rbm = DiigoBookmark(self, raw)
+        self.library.add(rbm, raw)
+        return rbm
+
+    def delete_all_local_bookmarks(self):
+        if self.interactive:
+            proceed('About to delete all local bookmarks.')
+
+        for file in glob.iglob(self.dir + '**/*.org', recursive=True):
+            if OrgBookmark(self, file).is_an_org_bookmark():
+                os.remove(file)
+                self.manifest.forget(file)
+
+    def read_sync_time(self):
+        last_sync_time = 0
+        try:
+            with open(os.path.join(self.stuff_dir,'.diigorg.sync'), 'r') as f:
+                last_sync_time = int(f.readline())
+                print( f'-- LAST SYNC: {time.strftime(ORG_TIMESTAMP_FORMAT, time.localtime(last_sync_time))}')
+        except:
+            print( f'Can\'t find {self.stuff_dir}.')
+            if self.interactive:
+                decision = input('Did you specify the correct directory? [y/n]: ' )
+                match decision:
+                    case 'y':pass
+                    case 'n':exit()
+        return last_sync_time
+
+    def update_sync_time(self):
+        # the next whole second, so that files written by this sync don't look changed to the next one
+        # while edits made right after it still do
+        self.last_sync_time = int(time.time()) + 1
+        with open(os.path.join(self.stuff_dir, '.diigorg.sync'), 'w') as f:
+            f.write(str(self.last_sync_time))
+        self.manifest.unsettle_all()
+
+    def needs_sync(self, path):
+        "whether an org file that was added, changed or removed needs a sync, rather than having been written by one"
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime > self.last_sync_time and not self.manifest.is_settled(path, stat.st_mtime_ns)) or path not in self.manifest.entries
+        except FileNotFoundError:
+            return path in self.manifest.entries
+
+    def remember(self, file):
+        "put an org file in the manifest, so that it can be told apart from new files, and so that deleting it can be acted on"
+        OrgBookmark(self, file).parse_and_fill_out()
+
+    def synced(self, file, fields=None):
+        """
+        remember() an org file this sync has just written or uploaded, and settle it. Until the last sync time moves past it,
+        which a scoped, resumed or interrupted sync doesn't do, the next sync would take it for an edit otherwise.
+        `fields` are what was written to it, so that it doesn't have to be read back. Without them, the manifest's
+        entry is kept if it's still up to date, as it is after an upload.
+        """
+        stat = os.stat(file)
+        if fields is not None:
+            self.manifest.store(file, stat.st_mtime_ns, stat.st_size, short_id_from_filename(file), fields)
+        elif not self.manifest.lookup(file, stat.st_mtime_ns, stat.st_size):
+            self.remember(file)
+        self.manifest.settle(file, stat.st_mtime_ns)
+
+    def remember_local_bookmarks(self):
+        "remember() every org file the manifest doesn't know yet"
+        for file in glob.iglob(self.dir + '**/*.org', recursive=True):
+            if file not in self.manifest.entries:
+                self.remember(file)
+        self.manifest.save()
+
+    def collect_local_bookmarks(self):
+        "collect every org file. Returns the paths of the ones the manifest knew that are gone"
+        logging.info('\n-- Collecting local org bookmarks from ' + self.dir)
+
+        for root in self.scope.roots:
+            for file in glob.iglob(root + '**/*.org', recursive=True):
+                if self.scope.covers_file(file):
+                    logline('Local', file, '-- Parsing')
+                    self.local_bookmark_list.append( OrgBookmark(self, file) )
+
+        found = set(bm.file for bm in self.local_bookmark_list)
+        removed = [path for path in self.manifest.entries if path not in found and self.scope.covers_file(path)]
+        if not self.scope:
+            self.local_files.fill(found)
+        elif self.scope.tag:
+            self.local_bookmark_list = [lbm for lbm in self.local_bookmark_list if self.scope.covers_tags(lbm.get_node_tags())]
+            removed = [path for path in removed if self.scope.covers_tags(self.manifest.fields(path)['tags'])]
+        return removed
+
+    def parse_local_bookmarks(self):
+        """
+        parse_and_fill_out() the collected org files that the manifest doesn't know, across `parse_workers` processes,
+        since reading them is pure python and a thread pool would only get one core's worth out of it.
+        Too few files to be worth starting the processes for are left for the planner to parse as it goes.
+        """
+        todo_keyword = self.cfg["options"]["todo_keyword"]
+        workers = self.cfg.getint('options', 'parse_workers', fallback=0) or os.cpu_count() or 1
+        unparsed = [lbm for lbm in self.local_bookmark_list
+                    if not lbm.is_parsed and self.manifest.lookup(lbm.file, lbm.mtime_ns, lbm.size) is None]
+        if workers < 2 or len(unparsed) < self.PARSE_IN_PROCESSES_MIN:
+            return
 
-total_changes = print_plan();
+        logging.info(f'\n-- Parsing {len(unparsed)} local org bookmarks in {workers} processes')
+        # enough files per task that sending them back and forth doesn't cost more than parsing them
+        chunks = [unparsed[start:start + self.PARSE_CHUNK_SIZE] for start in range(0, len(unparsed), self.PARSE_CHUNK_SIZE)]
+        with self.metrics.timer('parse_in_processes'), ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(parse_org_files, [[lbm.file for lbm in chunk] for chunk in chunks], itertools.repeat(todo_keyword))
+            for chunk, parsed in zip(chunks, results):
+                for lbm, (fields, bytes_read) in zip(chunk, parsed):
+                    self.metrics.add('file_bytes_read', bytes_read)
+                    lbm.fill_out_parsed(fields)
+
+    def collect_changed_local_bookmarks(self, paths):
+        "collect_local_bookmarks() for just the org files in `paths`"
+        logging.info(f'\n-- Collecting {len(paths)} changed local org bookmarks')
+
+        removed = []
+        for file in sorted(path for path in paths if self.scope.covers_file(path)):
+            if os.path.exists(file):
+                logline('Local', file, '-- Parsing')
+                lbm = OrgBookmark(self, file)
+                if file not in self.manifest.entries:
+                    lbm.parse_and_fill_out()
+                self.local_bookmark_list.append(lbm)
+                self.local_files.add(lbm.short_id, file)
+            else:
+                removed.append(file)
+        return removed
+
+    def __removed_bookmarks(self, removed):
+        "RemovedOrgBookmarks for the org files in `removed` whose bookmarks should be deleted from diigo.com"
+        collected = set(bm.short_id for bm in self.local_bookmark_list)
+        bookmarks = []
+        for file in removed:
+            short_id = short_id_from_filename(file)
+            # the manifest keeps it until the plan is carried out, and a deletion until diigo.com has made it
+            fields = self.manifest.fields(file)
+            self.local_files.remove(short_id, file)
+            if os.path.exists(file) or not fields or not fields['node_short_id'] or short_id in collected or short_id in self.fetched_hashes:
+                # not gone, not a bookmark, moved, or a fetched bookmark that the rest of the plan took care of
+                self.files_to_forget.append(file)
+                continue
+            if (moved_to := self.local_files.find(short_id)) and os.path.exists(moved_to):
+                self.files_to_forget.append(file)
+                continue
+
+            logline('Local', file, '', 'DELETED. Mark for deletion on diigo.com.')
+            bookmarks.append(RemovedOrgBookmark(self, file, fields))
+        return bookmarks
+
+    def print_plan(self):
+        total_changes = 0
+        print(f'\n{len(self.bookmarks_to_download)} new on diigo.com. Org file will be (over)written:\n------------------------------------')
+        for bm in self.bookmarks_to_download:
+            total_changes += 1
+            print(f'"{bm.bookmark["title"]}"')
+
+        print(f'\n{len(self.bookmarks_to_update_locally)} modified on diigo.com. Org file will be updated (notes will be preserved):\n------------------------------------')
+        for bm in self.bookmarks_to_update_locally:
+            total_changes += 1
+            print(f'"{bm.bookmark["title"]}"')
+
+        print(f'\n{len(self.bookmarks_to_delete_locally)} missing from diigo.com. Org file will be deleted:\n------------------------------------')
+        for bm in self.bookmarks_to_delete_locally:
+            total_changes += 1
+            print(f'"{bm.get_node_title()}"')
+
+        print(f'\n{len(self.bookmarks_to_upload)} modified org file. Bookmark Will be uploaded to diigo.com:\n------------------------------------')
+        for bm in self.bookmarks_to_upload:
+            total_changes += 1
+            print(f'"{bm.get_node_title()}"')
+
+        print(f'\n{len(self.bookmarks_to_delete_remotely)} missing org file. Bookmark will be deleted from diigo.com:\n------------------------------------')
+        for bm in self.bookmarks_to_delete_remotely:
+            total_changes += 1
+            print(f'"{bm.bookmark["title"]}"')
+
+        if self.offline:
+            print(f'\n{len(self.bookmarks_to_regenerate)} kept in .diigorg. Org file will be rewritten (notes will be preserved):\n------------------------------------')
+            for bm in self.bookmarks_to_regenerate:
+                total_changes += 1
+                print(f'"{bm.bookmark["title"]}"')
+
+        return total_changes
+
+    def planned_operations(self):
+        "operation name -> (pool, bookmark method, plan list)"
+        return {
+            'download' : ('local', 'write_bookmark_file', self.bookmarks_to_download),
+            'update' : ('local', 'update_bookmark_file', self.bookmarks_to_update_locally),
+            'delete_local' : ('local', 'delete_local_bookmark', self.bookmarks_to_delete_locally),
+            'upload' : ('network', 'upload_bookmark', self.bookmarks_to_upload),
+            'delete_remote' : ('network', 'delete_remote_bookmark', self.bookmarks_to_delete_remotely),
+            'regenerate' : ('local', 'regenerate_bookmark_file', self.bookmarks_to_regenerate)
+        }
 
-if not args.yes and total_changes > 0:
-    proceed()
+    def execute(self, operations=None):
+        """
+        carry out the plan, then record that the sync happened. `operations` can be (operation name, bookmark)
+        pairs from plan_stream(), and each one is started as soon as it comes.
+        """
+        plan = self.planned_operations()
+        if operations is None:
+            operations = [(name, bm) for name, (kind, method, bm_list) in plan.items() for bm in bm_list]
+
+        scheduler = SyncScheduler(self.cfg.getint('options', 'local_workers', fallback=4),
+                                  self.cfg.getint('network', 'network_workers', fallback=4))
+
+        def journaled(index, name, bm, operation):
+            def run():
+                if bm.short_id in self.remote_duplicates:
+                    # it turned out to share its id with another diigo.com bookmark after it was planned
+                    self.journal.complete(index)
+                    return
+                try:
+                    with self.metrics.timer(f'operation:{name}'):
+                        operation()
+                except Exception as e:
+                    if not self.resumed:
+                        raise
+                    # it gets one more try. The sync after this one will plan it again if it's still needed
+                    print( f'Couldn\'t finish an operation left over from the interrupted sync: {e}' )
+                    logging.exception(f'replaying {name} failed')
+                self.journal.complete(index)
+            return run
+
+        started = time.perf_counter()
+        self.executing = True
+        try:
+            try:
+                for name, bm in operations:
+                    kind, method, bm_list = plan[name]
+                    index = self.journal.add({'op' : name, **bm.to_journal()})
+                    if not self.args.safe:
+                        # the library follows diigo.com, and the journal sees to it that diigo.com follows this
+                        if name == 'upload':
+                            bm.parse_and_fill_out()
+                            self.library.uploading(bm.short_id, bm.bookmark)
+                        elif name == 'delete_remote':
+                            self.library.forget(bm.short_id)
+                    scheduler.add(bm.short_id, kind, journaled(index, name, bm, getattr(bm, method)))
+                self.journal.plan_complete()
+            finally:
+                self.executing = False
+            scheduler.wait()
+        except BaseException:
+            scheduler.shutdown()
+            # the files written before it stopped stay settled, for the sync that resumes it
+            self.manifest.save()
+            raise
+        self.metrics.observe('execute', time.perf_counter() - started)
+        for file in self.files_to_forget:
+            self.manifest.forget(file)
+
+        if not self.offline and not self.scope and not self.resumed:
+            # nothing was fetched, or only part of it, or only what the interrupted sync had planned,
+            # so whatever changed since the last sync still has to be
+            self.update_sync_time()
+            if self.sweep_window is not None:
+                self.save_sweep_cursor(self.sweep_window.since)
+        # within a scope, only what short_ids tell is in it can be replaced
+        replace = self.args.full_sync and not self.args.test and (not self.scope or self.scope.by_date)
+        covers = self.scope.covers_short_id if self.scope else None
+        if self.sweep_window is not None:
+            # the sweep fetched everything created in its window
+            replace, covers = True, self.sweep_window.covers_short_id
+        if not self.resumed and not self.offline:
+            # uploads and deletions change diigo.com, so those need another look next time
+            self.remote_snapshot.save(self.fetched_hashes, replace=replace, covers=covers,
+                                      forget_ids=self.unsettled_ids | set(bm.short_id for bm in self.bookmarks_to_upload + self.bookmarks_to_delete_remotely))
+        self.library.save(replace=replace and not self.resumed, kept=self.fetched_hashes, covers=covers)
+        self.journal.finish()
+        if not self.scope and not self.resumed:
+            # the sync after a resumed one may still carry on from an interrupted fetch
+            self.fetch_checkpoint.clear()
+        self.manifest.save()
+
+    def resume_interrupted_sync(self):
+        "offer to finish the operations an interrupted sync left undone. Returns True if they were queued up."
+        planned_at, self.resumed_plan_complete, operations = self.journal.pending()
+        if not operations:
+            self.journal.finish()
+            return False
+
+        if self.args.reset or self.cfg_mod_time > planned_at:
+            print( 'Discarding the unfinished operations of an interrupted sync.' )
+            self.journal.finish()
+            return False
+
+        print( f'The last sync was interrupted with {len(operations)} operations still to do.' )
+        decision = 'r' if self.args.yes else ''
+        while decision not in ['r','d','q']:
+            decision = input('[r] Resume it. [d] Discard it and do a new sync. [q] Quit :').lower()
 
-execute()
+        match decision:
+            case 'd':
+                self.journal.finish()
+                return False
+            case 'q':
+                exit()
+
+        plan = self.planned_operations()
+        for operation in operations:
+            if 'bookmark' in operation:
+                bm = DiigoBookmark(self, operation['bookmark'])
+                if operation['op'] in ['update', 'regenerate'] and not os.path.exists(bm.file):
+                    # it was deleted since. The next sync will see to that
+                    logging.info(f'Not resuming the {operation["op"]} of {bm.file}, which is gone')
+                    continue
+            elif 'removed' in operation:
+                bm = RemovedOrgBookmark(self, operation['removed'], operation['fields'])
+            elif os.path.exists(operation['file']):
+                bm = OrgBookmark(self, operation['file'])
+            else:
+                continue
+            plan[operation['op']][2].append(bm)
 
-update_sync_time()
+        return True
 
-print('Done!')
-print(f'Downloaded \t{num_dl} bookmarks.')
-print(f'Uploaded \t{num_ul} bookmarks.')
-print(f'Deleted \t{num_del} bookmarks.')
+def create_default_config(cfg_file):
+    cfg = configparser.ConfigParser()
+    cfg.add_section('diigo_credentials')
+    cfg['diigo_credentials'] = {
+        'username' : '',
+        'passwd' : '',
+        'api_key' : 'Get your diigo application key here: https://www.diigo.com/api_keys/new/'
+    }
+    cfg.add_section('options')
+    cfg['options'] = {
+        'subdirs' : '%%Y',
+        'todo_keyword' : 'TODO',
+        'notes_section' : 'yes',
+        'local_workers' : '4',
+        'parse_workers' : '0',
+        'watch_interval' : '2',
+        'log_level' : 'INFO',
+        'log_in_background' : 'no'
+    }
+    cfg.add_section('network')
+    cfg['network'] = {
+        'retries' : '5',
+        'retry_backoff' : '1.0',
+        'requests_per_second' : '5',
+        'fetch_concurrency' : '4',
+        'network_workers' : '4',
+        'sweep_pages' : '0'
+    }
+    cfg.add_section('file_properties')
+    cfg['file_properties'] = {
+        'title' : 'yes',
+        'org_id' : 'no',
+        'roam_refs' : 'no',
+        'diigo_search_link' : 'no',
+        'tags' : 'no'
+        }
+    cfg.add_section('heading_properties')
+    cfg['heading_properties'] = {
+        'org_id' : 'yes',
+        'roam_refs' : 'no',
+        'diigo_search_link' : 'yes',
+        'tags' : 'yes'
+        }
+
+    with open(cfg_file, 'w') as cfgfile:
+        cfg.write(cfgfile)
+
+# notices org files being added, changed or removed by looking over the whole tree every `interval` seconds
+class PollingWatcher:
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.files = self.__scan()
+
+    def __scan(self):
+        files = {}
+        for file in glob.iglob(self.root + '**/*.org', recursive=True):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            files[file] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def wait(self, timeout, relevant=lambda path: True):
+        "wait up to `timeout` seconds for relevant org files to change. Returns the paths that did"
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            time.sleep(min(self.interval, remaining))
+            files = self.__scan()
+            changed = set(file for file in files.keys() | self.files.keys() if files.get(file) != self.files.get(file) and relevant(file))
+            self.files = files
+            if changed:
+                return changed
+        return set()
+
+# notices org files being added, changed or removed as it happens, with linux's inotify
+class InotifyWatcher:
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, root):
+        import ctypes
+        self.root = root
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.dirs = {}
+        try:
+            self.__watch_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def __watch_tree(self, root):
+        import ctypes
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        for dir, subdirs, files in os.walk(root):
+            # like glob, leave out hidden directories such as .diigorg
+            subdirs[:] = [subdir for subdir in subdirs if not subdir.startswith('.')]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), mask)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), dir)
+            self.dirs[wd] = dir
+
+    def __read(self):
+        "the org files named by the events waiting to be read, or None if some of them were lost"
+        paths = set()
+        lost_track = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + self.EVENT.size : offset + self.EVENT.size + length].rstrip(b'\0'))
+                offset += self.EVENT.size + length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    lost_track = True
+                elif mask & self.IN_IGNORED:
+                    # the directory is gone
+                    self.dirs.pop(wd, None)
+                elif wd not in self.dirs or name.startswith('.'):
+                    pass
+                elif mask & self.IN_ISDIR:
+                    # a directory coming or going takes its org files with it, and its subdirectories need watching
+                    lost_track = True
+                elif name.endswith('.org'):
+                    paths.add(os.path.join(self.dirs[wd], name))
+
+        if lost_track:
+            self.__watch_tree(self.root)
+            return None
+        return paths
+
+    def wait(self, timeout, relevant=lambda path: True):
+        """
+        wait up to `timeout` seconds for relevant org files to change. Returns the paths that did,
+        or None if it lost track of them and the whole tree needs to be looked at.
+        """
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                break
+            # an editor saving a file makes a few events in a row. Take them all together
+            time.sleep(0.1)
+            changed = self.__read()
+            if changed is None:
+                return None
+            changed = set(path for path in changed if relevant(path))
+            if changed:
+                return changed
+        return set()
+
+def make_watcher(root, interval):
+    "an InotifyWatcher where there's inotify, and a PollingWatcher otherwise"
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            logging.warning(f'Can\'t watch {root} with inotify ({e}). Polling it instead.')
+    return PollingWatcher(root, interval)
+
+def run_daemon(syncer, interval):
+    "sync every `interval` seconds, and soon after any org file changes, until interrupted"
+    if not os.path.exists(os.path.join(syncer.stuff_dir, '.diigorg.sync')):
+        raise SyncError(f'{syncer.dir} has never been synced. Run diigorg without --daemon first.')
+
+    # held throughout, rather than just for each sync
+    with syncer.sync_lock:
+        watcher = make_watcher(syncer.dir, syncer.cfg.getfloat('options', 'watch_interval', fallback=2))
+        # the manifest has to know every org file for their deletions to be noticed
+        syncer.remember_local_bookmarks()
+        print( f'Syncing {syncer.dir} every {interval} seconds, and whenever an org file changes. Ctrl-C to stop.' )
+
+        # None means look over the whole tree, which the first sync has to do since nothing was watching before it
+        changed_paths = None
+        while True:
+            try:
+                syncer.sync(changed_paths)
+                changed_paths = set()
+            except Exception as e:
+                # keep going, and hold on to the changes for the next sync. Whatever went wrong may be fine by then
+                print( f'The sync failed: {e}' )
+                logging.exception('sync failed')
+
+            changed = watcher.wait(interval, relevant=syncer.needs_sync)
+            if changed is None or changed_paths is None:
+                changed_paths = None
+            else:
+                changed_paths |= changed
+                logging.info(f'{len(changed)} org files changed')
+
+def setup_logging(log_file, level, in_background=False):
+    """
+    Log to `log_file` at `level`. If `in_background`, records go through a queue to a thread that writes them,
+    so that the sync doesn't wait on the log file. Returns that thread's QueueListener, to stop() at the end, or None.
+    """
+    handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    if not in_background:
+        logging.basicConfig(level=level, handlers=[handler])
+        return None
+
+    # imported here rather than at the top, like the other modules that only some runs need
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+    listener = QueueListener(queue.SimpleQueue(), handler)
+    queue_handler = QueueHandler(listener.queue)
+    # the file's handler adds the level and logger name when it writes the record out
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener.start()
+    return listener
+
+def run_profiled(profile_file, function):
+    "call `function` under cProfile, then print the calls that took longest and save the stats for pstats or snakeviz"
+    # imported here rather than at the top, since most runs don't profile
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(profile_file)
+        print( f'\nProfile saved to {profile_file}' )
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+def main():
+    options = vars(argParser.parse_args())
+    directory = options.pop('dir')
+    daemon = options.pop('daemon')
+    profile = options.pop('profile')
+    log_level = options.pop('log_level')
+
+    ####### CONFIG FILE
+    cfg_file = os.path.join(directory, 'diigorg.cfg')
+    if not os.path.exists(cfg_file):
+        create_default_config(cfg_file)
+        print( 'diigorg.cfg has been created. Edit it and rerun diigorg.' )
+        exit()
+
+    if daemon:
+        # there's nobody to ask
+        options['yes'] = True
+
+    log_listener = None
+    try:
+        syncer = Syncer(directory, interactive=not daemon, **options)
+        # for the whole run, so that a diigorg that's already syncing doesn't even have its log started over
+        with syncer.sync_lock:
+            log_listener = setup_logging(os.path.join(syncer.stuff_dir,'diigorg.log'),
+                                         (log_level or syncer.cfg.get('options', 'log_level', fallback='INFO')).upper(),
+                                         syncer.cfg.getboolean('options', 'log_in_background', fallback=False))
+
+            if syncer.options.test:
+                print( "TESTING..." )
+
+            run = (lambda: run_daemon(syncer, daemon)) if daemon else syncer.sync
+            if profile:
+                run_profiled(profile if isinstance(profile, str) else os.path.join(syncer.stuff_dir, 'diigorg.prof'), run)
+            else:
+                run()
+    except SyncError as e:
+        print( e )
+        exit(1)
+    except KeyboardInterrupt:
+        exit(1)
+    finally:
+        if log_listener:
+            log_listener.stop()
+
+if __name__ == '__main__':
+    main()
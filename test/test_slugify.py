@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# slugify() against what django's slugify gave for the same titles, so that org file names stay the same without django.
+#
+#   python3 -m pytest test/    or    python3 -m unittest discover test
+#
+# The expected slugs were generated with Django 4.0.1's django.template.defaultfilters.slugify.
+# bench/startup.py compares a larger random corpus when django is installed.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diigorg
+
+DJANGO_SLUGS = [
+    ('', ''),
+    ('   ', ''),
+    ('Hello World', 'hello-world'),
+    ('hello   world', 'hello-world'),
+    ('Tabs\tand\nnewlines', 'tabs-and-newlines'),
+    ('Crème brûlée', 'creme-brulee'),
+    ('Über naïve café', 'uber-naive-cafe'),
+    ('Ærøskøbing Œuvre', 'rskbing-uvre'),
+    ('Straße', 'strae'),
+    ('ﬁnal ﬂow ﬀ', 'final-flow-ff'),
+    ('İstanbul', 'istanbul'),
+    ('Ελληνικά', ''),
+    ('Русский текст', ''),
+    ('日本語のタイトル', ''),
+    ('Emoji 🎉 party', 'emoji-party'),
+    ('½ and ² and ｆｕｌｌｗｉｄｔｈ', '12-and-2-and-fullwidth'),
+    ('Non\xa0breaking\u2009space', 'non-breaking-space'),
+    ('em — dash – en', 'em-dash-en'),
+    ("Don't stop", 'dont-stop'),
+    ('C++ & C#: a guide', 'c-c-a-guide'),
+    ('Python 2.0 review', 'python-20-review'),
+    ('-leading and trailing-', 'leading-and-trailing'),
+    ('_leading and trailing_', 'leading-and-trailing'),
+    ('-_-mixed_-_', 'mixed'),
+    ('--double--hyphen--', 'double-hyphen'),
+    ('snake_case_title', 'snake_case_title'),
+    (' _ - _ ', ''),
+    ('-', ''),
+    ('_', ''),
+    ('???', ''),
+    ('UPPER lower MiXeD', 'upper-lower-mixed'),
+    ('a/b\\c|d', 'abcd'),
+    ('100% pure (really!)', '100-pure-really'),
+]
+
+class SlugifyTest(unittest.TestCase):
+    def test_matches_django(self):
+        for title, slug in DJANGO_SLUGS:
+            with self.subTest(title=title):
+                self.assertEqual(diigorg.slugify(title), slug)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# Syncs that are interrupted, turned down, resumed or limited, against bench/mock_diigo.py, so that they run offline.
+#
+#   python3 -m pytest test/    or    python3 -m unittest discover test
+
+import io
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TEST_DIR), 'bench'))
+import diigorg
+import mock_diigo
+from sync import make_tree
+
+class SyncTest(unittest.TestCase):
+    COUNT = 40
+
+    def setUp(self):
+        self.mock = mock_diigo.MockDiigo(mock_diigo.synthetic_bookmarks(self.COUNT, annotations=0.3))
+        self.server, api_url = mock_diigo.start_server(self.mock)
+        self.dir = tempfile.mkdtemp()
+        make_tree(self.dir, api_url)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def syncer(self, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return diigorg.Syncer(self.dir, interactive=False, yes=True, **options)
+
+    def sync(self, **options):
+        syncer = self.syncer(**options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            syncer.sync()
+        return syncer
+
+    def plan(self, **options):
+        "plan a sync, and then turn it down"
+        syncer = self.syncer(**options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            syncer.plan()
+        return syncer
+
+    def wait_past_last_sync(self, syncer):
+        "diigo.com's timestamps are whole seconds, so that changes made from now on are newer than the last sync"
+        while time.time() < syncer.last_sync_time + 1:
+            time.sleep(0.05)
+
+    def org_files(self):
+        return sorted(glob.iglob(os.path.join(self.dir, '**', '*.org'), recursive=True))
+
+    def org_file(self, raw):
+        "the org file of a bookmark the mock serves"
+        syncer = self.syncer()
+        return syncer.local_files.find(diigorg.DiigoBookmark(syncer, raw).short_id)
+
+    def org_text(self, raw):
+        with open(self.org_file(raw), encoding='utf-8') as f:
+            return f.read()
+
+    def sync_time(self):
+        with open(os.path.join(self.dir, '.diigorg', '.diigorg.sync')) as f:
+            return f.read()
+
+    def interrupt_after(self, writes):
+        "make the org file writes after the first `writes` of them fail, as a full disk would"
+        write = diigorg.DiigoBookmark.write_bookmark_file
+        count = iter(range(writes))
+        def failing(bm):
+            if next(count, None) is None:
+                raise OSError('No space left on device')
+            return write(bm)
+        return mock.patch.object(diigorg.DiigoBookmark, 'write_bookmark_file', failing)
+
+    def journal(self, operations, complete=True):
+        "leave a journal behind, as a sync interrupted after planning `operations` would"
+        journal = diigorg.SyncJournal(os.path.join(self.dir, '.diigorg', 'journal'))
+        for operation in operations:
+            journal.add(operation)
+        if complete:
+            journal.plan_complete()
+        journal.file.close()
+
+    def test_turned_down_plan_keeps_local_deletion(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        os.remove(self.org_files()[0])
+
+        self.plan()
+        self.assertEqual(len(self.mock.bookmarks), self.COUNT)
+        syncer = self.sync()
+        self.assertEqual(syncer.num_del, 1)
+        self.assertEqual(len(self.mock.bookmarks), self.COUNT - 1)
+
+    def test_safe_sync_keeps_local_deletion(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        os.remove(self.org_files()[0])
+
+        self.sync(safe=True)
+        self.assertEqual(len(self.mock.bookmarks), self.COUNT)
+        self.sync()
+        self.assertEqual(len(self.mock.bookmarks), self.COUNT - 1)
+
+    def test_interrupted_sync_settles_what_it_wrote(self):
+        with self.interrupt_after(10), self.assertRaises(OSError):
+            self.sync(full_sync=True)
+        self.assertGreaterEqual(len(self.org_files()), 10)
+
+        syncer = self.sync()
+        self.assertEqual(len(self.org_files()), self.COUNT)
+        self.assertEqual(self.mock.requests['POST'], 0)
+        syncer = self.sync()
+        self.assertEqual(syncer.num_ul, 0)
+        self.assertEqual(self.mock.requests['POST'], 0)
+
+    def test_resumed_sync_keeps_last_sync_time(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        last_sync = self.sync_time()
+        first, second = list(self.mock.bookmarks.values())[:2]
+        self.journal([{'op' : 'download', 'bookmark' : first}])
+        # changed on diigo.com after the interrupted sync made its plan
+        self.mock.post({**second, 'title' : 'Changed after the plan'})
+
+        syncer = self.sync()
+        self.assertTrue(syncer.resumed)
+        self.assertEqual(self.sync_time(), last_sync)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, '.diigorg', 'journal')))
+
+        syncer = self.sync()
+        self.assertEqual(syncer.num_dl, 1)
+        self.assertIn('Changed after the plan', self.org_text(self.mock.bookmarks[second['url']]))
+        self.assertNotEqual(self.sync_time(), last_sync)
+
+    def test_partial_plan_is_followed_by_a_new_sync(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        first, second = list(self.mock.bookmarks.values())[:2]
+        self.journal([{'op' : 'download', 'bookmark' : first}], complete=False)
+        self.mock.post({**second, 'title' : 'Changed after the plan'})
+
+        syncer = self.sync()
+        self.assertFalse(syncer.resumed)
+        self.assertIn('Changed after the plan', self.org_text(self.mock.bookmarks[second['url']]))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, '.diigorg', 'journal')))
+
+    def test_resumed_update_of_deleted_file_is_skipped(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        raw = list(self.mock.bookmarks.values())[0]
+        os.remove(self.org_file(raw))
+        self.journal([{'op' : 'update', 'bookmark' : raw}])
+
+        syncer = self.sync()
+        self.assertTrue(syncer.resumed)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, '.diigorg', 'journal')))
+
+    def test_failed_resumed_operation_finishes_the_journal(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        self.journal([{'op' : 'download', 'bookmark' : raw} for raw in list(self.mock.bookmarks.values())[:3]])
+
+        with self.interrupt_after(1):
+            syncer = self.sync()
+        self.assertTrue(syncer.resumed)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, '.diigorg', 'journal')))
+
+    def test_turned_down_full_sync_fetches_again(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        self.plan(full_sync=True)
+        # only a full sync notices a deletion on diigo.com
+        self.mock.delete(list(self.mock.bookmarks.values())[0])
+
+        syncer = self.sync(full_sync=True)
+        self.assertEqual(syncer.num_del, 1)
+        self.assertEqual(len(self.org_files()), self.COUNT - 1)
+
+    def test_scoped_sync_keeps_last_sync_time_and_settles_what_it_wrote(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        last_sync = self.sync_time()
+        raw = list(self.mock.bookmarks.values())[0]
+        folder = os.path.basename(os.path.dirname(self.org_file(raw)))
+        self.mock.post({**raw, 'desc' : 'Changed on diigo.com'})
+
+        syncer = self.sync(folder=folder)
+        self.assertEqual(syncer.num_dl, 1)
+        self.assertEqual(self.sync_time(), last_sync)
+        file = self.org_file(self.mock.bookmarks[raw['url']])
+        self.assertTrue(syncer.manifest.is_settled(file, os.stat(file).st_mtime_ns))
+
+        syncer = self.sync()
+        self.assertEqual(syncer.num_ul, 0)
+        self.assertEqual(self.mock.requests['POST'], 0)
+
+    def test_manifest_matches_the_files(self):
+        syncer = self.sync(full_sync=True)
+        self.wait_past_last_sync(syncer)
+        for raw in list(self.mock.bookmarks.values())[:5]:
+            self.mock.post({**raw, 'desc' : raw['desc'] + ' and more', 'tags' : raw['tags'] + ',more'})
+        self.sync()
+
+        manifest = self.syncer().manifest
+        self.assertEqual(sorted(manifest.entries), self.org_files())
+        for file in self.org_files():
+            stat = os.stat(file)
+            self.assertEqual(manifest.lookup(file, stat.st_mtime_ns, stat.st_size), diigorg.parse_org_file(file, 'TODO')[0])
+
+if __name__ == '__main__':
+    unittest.main()